@@ -0,0 +1,72 @@
+"""
+Generators of synthetic resource graphs for the benchmarks.
+"""
+import random
+
+from pyramid_maze import Node, Graph
+
+
+def layered_dag(width, depth, fan_in=1, seed=0):
+    """
+    Builds a graph of ``depth`` layers of ``width`` nodes each, under a
+    single root. The root nests every node of the first layer, and every
+    other node is nested under ``fan_in`` random nodes of the layer above.
+
+    :return: A tuple of the :ref:`Graph` and the list of its layers.
+    """
+    rng = random.Random(seed)
+    root = Node('root')
+    layers = []
+    parents = [root]
+    for level in xrange(depth):
+        layer = [Node('n%d_%d' % (level, index)) for index in xrange(width)]
+        for node in layer:
+            if parents[0] is root:
+                root.add_child(node)
+                continue
+            for parent in rng.sample(parents, min(fan_in, len(parents))):
+                parent.add_child(node)
+        layers.append(layer)
+        parents = layer
+    return Graph(root), layers
+
+
+def diamond_lattice(levels):
+    """
+    Builds ``levels`` stacked diamonds, which have ``2 ** levels`` distinct
+    paths from the root to the last node. Anything that enumerates paths
+    rather than nodes blows up on it.
+
+    :return: A tuple of the :ref:`Graph` and its last node.
+    """
+    root = sink = Node('d0')
+    for level in xrange(1, levels + 1):
+        left, right = Node('l%d' % level), Node('r%d' % level)
+        join = Node('d%d' % level)
+        sink.add_child(left)
+        sink.add_child(right)
+        left.add_child(join)
+        right.add_child(join)
+        sink = join
+    return Graph(root), sink
+
+
+def includes_for(graph, target, count, seed=0):
+    """
+    Picks ``count`` nodes that some path from the root of ``graph`` to
+    ``target`` visits, so that routing through them is always feasible.
+    """
+    rng = random.Random(seed)
+    ancestors = graph.reachability.ancestors_of(target)
+    # walk back up from the target through random parents
+    path = []
+    node = target
+    while node is not graph.root:
+        parents = [
+            parent for parent in ancestors
+            if parent is not node and node in parent.children
+        ]
+        node = rng.choice(parents)
+        path.append(node)
+    candidates = [parent for parent in path if parent is not graph.root]
+    return rng.sample(candidates, min(count, len(candidates)))
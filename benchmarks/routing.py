@@ -0,0 +1,169 @@
+"""
+Times graph traversal and routing on synthetic resource graphs.
+
+Run it standalone to print the results as JSON, which can be saved and
+compared against the results of another commit::
+
+    python -m benchmarks.routing --output HEAD.json
+    python -m benchmarks.routing --compare HEAD.json
+
+"""
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from pyramid_maze import Maze, traverse
+from pyramid_maze.helpers import draw_tree
+
+from .graphs import layered_dag, diamond_lattice, includes_for
+
+
+def _peak_memory(fn):
+    """
+    Returns the peak memory allocated while calling ``fn``, in bytes, as
+    measured with ``tracemalloc``. Where it isn't available, ``None`` is
+    returned instead: the process' maximum resident set size only grows past
+    its previous peak, so it says nothing about ``fn``.
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(name, fn, rounds=5, **params):
+    timings = []
+    gc.collect()
+    for _ in xrange(rounds):
+        started = time.time()
+        fn()
+        timings.append(time.time() - started)
+    return {
+        'name': name,
+        'params': params,
+        'rounds': rounds,
+        'best': min(timings),
+        'mean': sum(timings) / len(timings),
+        'peak_memory': _peak_memory(fn),
+    }
+
+
+def visit_nodes(graph):
+    seen = set()
+
+    def on_visit(node):
+        if node in seen:
+            return
+        seen.add(node)
+        return node
+
+    traverse(graph.root, on_visit, validate=False)
+    return seen
+
+
+def run(width=10, depth=6, fan_in=3, max_includes=3, lattice_levels=60,
+        rounds=5):
+    results = []
+    params = dict(width=width, depth=depth, fan_in=fan_in)
+
+    def nodes():
+        graph._nodes = None
+        return graph.nodes
+
+    graph, layers = layered_dag(width, depth, fan_in)
+    results.append(measure('graph.nodes', nodes, rounds, **params))
+    results.append(measure(
+        'traverse', lambda: visit_nodes(graph), rounds, **params
+    ))
+
+    target = layers[-1][0]
+    for count in xrange(max_includes + 1):
+        include = includes_for(graph, target, count)
+        maze = Maze(graph, cache_size=0)
+        results.append(measure(
+            'maze.route', lambda: maze.route(target, include), rounds,
+            includes=count, **params
+        ))
+
+    results.append(measure(
+        'draw_tree', lambda: draw_tree(graph.root), rounds, **params
+    ))
+
+    lattice, sink = diamond_lattice(lattice_levels)
+    maze = Maze(lattice, cache_size=0)
+    results.append(measure(
+        'diamond_lattice.route', lambda: maze.route(sink), rounds,
+        levels=lattice_levels
+    ))
+    return results
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD']
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results):
+    def key(result):
+        return result['name'], tuple(sorted(result['params'].items()))
+
+    previous = dict((key(result), result) for result in baseline['results'])
+    for result in results:
+        before = previous.get(key(result))
+        if not before:
+            continue
+        params = sorted(result['params'].items())
+        print '%-24s %-40s %8.2fx' % (
+            result['name'],
+            ','.join('%s=%s' % item for item in params),
+            result['best'] / before['best'] if before['best'] else 0,
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--width', type=int, default=10)
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument('--fan-in', type=int, default=3)
+    parser.add_argument('--max-includes', type=int, default=3)
+    parser.add_argument('--lattice-levels', type=int, default=60)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--compare', help='results to compare against')
+    args = parser.parse_args(argv)
+
+    results = run(args.width, args.depth, args.fan_in, args.max_includes,
+                  args.lattice_levels, args.rounds)
+    report = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(json.load(fp), results)
+
+
+if __name__ == '__main__':
+    main()
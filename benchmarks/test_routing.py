@@ -0,0 +1,75 @@
+"""
+Routing benchmarks for ``pytest-benchmark``::
+
+    py.test benchmarks/ --benchmark-only
+
+The diamond lattice cases also run without the plugin, and fail if routing
+regresses to enumerating paths.
+"""
+import time
+
+from pyramid_maze import Maze
+from pyramid_maze.helpers import draw_tree
+import pytest
+
+from .graphs import layered_dag, diamond_lattice, includes_for
+from .routing import visit_nodes
+
+
+@pytest.fixture(scope='module')
+def dag():
+    return layered_dag(width=10, depth=6, fan_in=3)
+
+
+try:
+    import pytest_benchmark  # noqa
+except ImportError:
+    @pytest.fixture()
+    def benchmark():
+        pytest.skip('pytest-benchmark is not installed')
+
+
+def test_graph_nodes(benchmark, dag):
+    graph, _ = dag
+
+    def nodes():
+        graph._nodes = None
+        return graph.nodes
+
+    assert len(benchmark(nodes)) == 61
+
+
+def test_traverse(benchmark, dag):
+    graph, _ = dag
+    assert len(benchmark(visit_nodes, graph)) == 61
+
+
+@pytest.mark.parametrize('count', [0, 1, 2, 3])
+def test_route(benchmark, dag, count):
+    graph, layers = dag
+    target = layers[-1][0]
+    include = includes_for(graph, target, count)
+    maze = Maze(graph, cache_size=0)
+    assert benchmark(maze.route, target, include)[-1] is target
+
+
+def test_draw_tree(benchmark, dag):
+    graph, _ = dag
+    # every node is drawn in full once, and once more per extra parent
+    assert len(benchmark(draw_tree, graph.root).splitlines()) == 1 + len(
+        graph.edges
+    )
+
+
+@pytest.mark.parametrize('levels', [40, 80])
+def test_diamond_lattice(levels):
+    graph, sink = diamond_lattice(levels)
+    maze = Maze(graph, cache_size=0)
+    started = time.time()
+    path = maze.route(sink)
+    include = [graph['r%d' % level] for level in xrange(1, levels, 10)]
+    path_with_includes = maze.route(sink, include)
+    elapsed = time.time() - started
+    assert len(path) == len(path_with_includes) == 2 * levels + 1
+    # exponential algorithms take days here
+    assert elapsed < 1.0
@@ -0,0 +1,12 @@
+from .wsgi import run
+
+
+def test_wsgi_harness():
+    report = run(corporations=5, departments=2, employees=1, requests=30)
+    assert report['requests'] == 30
+    assert report['dataset'] == {
+        'corporations': 5, 'departments': 10, 'employees': 10,
+    }
+    assert 0 < report['latency_ms']['p50'] <= report['latency_ms']['p99']
+    assert report['queries_per_request']['traversal'] > 0
+    assert report['ms_per_request']['view_lookup'] > 0
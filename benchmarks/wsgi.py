@@ -0,0 +1,248 @@
+"""
+Drives nested urls through the sample application in-process, and reports
+latency percentiles, throughput, and the SQL queries and time spent in each
+stage of a request::
+
+    python -m benchmarks.wsgi --corporations 1000 --requests 5000
+
+"""
+import argparse
+from collections import defaultdict
+from functools import wraps
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, event
+from webob import Request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'tests'))
+import simple_app  # noqa
+
+
+#: the stage that queries and time are attributed to outside of any other,
+#: i.e. pyramid's router, the rest of view lookup and the view itself
+OTHER = 'other'
+
+
+def seed(path, corporations, departments, employees, seed=0):
+    """
+    Creates a sqlite database at ``path`` with ``corporations``, each with
+    ``departments`` that each have ``employees``, and binds the sample
+    application's session to it.
+
+    :return: A tuple of the engine and the primary keys of the departments,
+             paired with the primary keys of their corporations.
+    """
+    rng = random.Random(seed)
+    engine = create_engine('sqlite:///%s' % path)
+    simple_app.Base.metadata.create_all(engine)
+
+    corporation_rows, department_rows, employee_rows = [], [], []
+    for c in xrange(corporations):
+        corporation_pk = u'CR%d' % c
+        corporation_rows.append({'pk': corporation_pk, 'name': u'corp'})
+        for d in xrange(departments):
+            department_pk = u'DP%d_%d' % (c, d)
+            department_rows.append({
+                'pk': department_pk,
+                'name': u'dept',
+                'corporation_pk': corporation_pk,
+            })
+            for e in xrange(employees):
+                employee_rows.append({
+                    'pk': u'EM%d_%d_%d' % (c, d, e),
+                    'name': u'employee',
+                    'department_pk': department_pk,
+                })
+
+    tables = simple_app.Base.metadata.tables
+    with engine.begin() as conn:
+        conn.execute(tables['corporations'].insert(), corporation_rows)
+        conn.execute(tables['departments'].insert(), department_rows)
+        if employee_rows:
+            conn.execute(tables['employees'].insert(), employee_rows)
+
+    simple_app.Session.remove()
+    simple_app.Session.configure(bind=engine)
+    keys = [(row['corporation_pk'], row['pk']) for row in department_rows]
+    rng.shuffle(keys)
+    return engine, keys
+
+
+class StageRecorder(object):
+    """
+    Attributes the SQL queries issued and the time spent while handling a
+    request to the stage that was running at the time.
+
+    Stages are entered by calling the methods wrapped with :meth:`watch`.
+    Time spent in a nested stage only counts towards the innermost one.
+
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.stack = [OTHER]
+        self.queries = defaultdict(int)
+        self.timings = defaultdict(float)
+        self._restores = []
+        self._entered = time.time()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.queries[self.stack[-1]] += 1
+
+    def _switch(self, stage=None):
+        now = time.time()
+        self.timings[self.stack[-1]] += now - self._entered
+        self._entered = now
+        if stage:
+            self.stack.append(stage)
+        else:
+            self.stack.pop()
+
+    def watch(self, owner, name, stage):
+        attr = owner.__dict__[name]
+        is_classmethod = isinstance(attr, classmethod)
+        fn = attr.__func__ if is_classmethod else attr
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            self._switch(stage)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._switch()
+
+        setattr(owner, name, classmethod(wrapper) if is_classmethod
+                else wrapper)
+        self._restores.append(lambda: setattr(owner, name, attr))
+
+    def reset(self):
+        self.queries.clear()
+        self.timings.clear()
+        self._entered = time.time()
+
+    def finish(self):
+        self._switch(OTHER)
+        self.stack.pop()
+        return dict(self.queries), dict(self.timings)
+
+    def close(self):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+        for restore in reversed(self._restores):
+            restore()
+
+
+def percentile(ordered, fraction):
+    index = int(round(fraction * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def run(corporations=1000, departments=5, employees=3, requests=5000,
+        seed_=0):
+    workdir = tempfile.mkdtemp(prefix='pyramid_maze_bench')
+    # leave the sample application's session as it was found
+    session = simple_app.Session()
+    bind = simple_app.Session.session_factory.kw.get('bind')
+    try:
+        engine, keys = seed(os.path.join(workdir, 'bench.db'),
+                            corporations, departments, employees, seed_)
+        app = simple_app.make_app()
+
+        rng = random.Random(seed_)
+        urls = []
+        for _ in xrange(requests):
+            corporation_pk, department_pk = rng.choice(keys)
+            urls.append(rng.choice([
+                '/Corporations/%s/Departments/%s' % (corporation_pk,
+                                                     department_pk),
+                '/Departments/%s' % department_pk,
+                '/Corporations/%s' % corporation_pk,
+            ]))
+
+        recorder = StageRecorder(engine)
+        recorder.watch(simple_app.Resource, '__getitem__', 'traversal')
+        # the views of a context are told apart by the controller's
+        # dispatch map, or by their predicates
+        recorder.watch(simple_app.Controller, '_view_name', 'view_lookup')
+        recorder.watch(simple_app.ResourcePredicate, '__call__',
+                       'view_lookup')
+        recorder.watch(simple_app.Controller, 'route', 'route')
+        recorder.watch(simple_app.Controller, 'route_many', 'route')
+        recorder.watch(simple_app.Resource, 'lookup_parent_entities',
+                       'parents')
+        recorder.watch(simple_app.DymamicResource, 'lookup_parent_entities',
+                       'parents')
+
+        latencies = []
+        queries = defaultdict(int)
+        timings = defaultdict(float)
+        try:
+            started = time.time()
+            for url in urls:
+                recorder.reset()
+                request_started = time.time()
+                response = Request.blank(url).get_response(app)
+                simple_app.Session.remove()
+                latencies.append(time.time() - request_started)
+                assert response.status_int == 200, (url, response.status)
+                request_queries, request_timings = recorder.finish()
+                for stage, count in request_queries.iteritems():
+                    queries[stage] += count
+                for stage, elapsed in request_timings.iteritems():
+                    timings[stage] += elapsed
+            elapsed = time.time() - started
+        finally:
+            recorder.close()
+    finally:
+        simple_app.Session.remove()
+        simple_app.Session.configure(bind=bind)
+        simple_app.Session.registry.set(session)
+        shutil.rmtree(workdir)
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'dataset': {
+            'corporations': corporations,
+            'departments': corporations * departments,
+            'employees': corporations * departments * employees,
+        },
+        'requests_per_second': requests / elapsed,
+        'latency_ms': dict(
+            (name, percentile(latencies, fraction) * 1000)
+            for name, fraction in (('p50', .5), ('p95', .95), ('p99', .99))
+        ),
+        'queries_per_request': dict(
+            (stage, float(count) / requests)
+            for stage, count in queries.iteritems()
+        ),
+        'ms_per_request': dict(
+            (stage, elapsed * 1000 / requests)
+            for stage, elapsed in timings.iteritems()
+        ),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--corporations', type=int, default=1000)
+    parser.add_argument('--departments', type=int, default=5,
+                        help='departments per corporation')
+    parser.add_argument('--employees', type=int, default=3,
+                        help='employees per department')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    report = run(args.corporations, args.departments, args.employees,
+                 args.requests, args.seed)
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    print
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,12 @@
 __version__ = '1.0.0'
 
-from .helpers import traverse, convert_to_snake_case
-from .maze import Maze, Node, Graph
+from . import instrumentation
+from .cache import LRUCache, EntityCache
+from .dispatch import Dispatcher
+from .helpers import traverse, convert_to_snake_case, Lineage
+from .maze import (
+    Maze, Node, Graph, RouteTable, FrozenGraph, NoRouteFound, CycleError
+)
+from .reachability import Reachability
+from .resolver import ParentResolver
+from . import snapshot
@@ -0,0 +1,153 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping bounded to ``maxsize`` entries. Once full, the
+    least recently used entry is evicted to make room for a new one.
+
+    If ``ttl`` is given, entries also expire ``ttl`` seconds after they were
+    set, and are treated as missing from then on.
+
+    Hits, misses and evictions are counted, see :attr:`stats`.
+
+    """
+    def __init__(self, maxsize=128, ttl=None, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= self.clock():
+                self.misses += 1
+                return default
+            # re-insert to mark it as the most recently used
+            self._entries[key] = (value, expires)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def prune(self, predicate):
+        """
+        Deletes every entry whose key satisfies ``predicate``.
+
+        :return: The number of entries deleted.
+        """
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    @property
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._entries),
+        }
+
+
+class EntityCache(object):
+    """
+    Caches the entities resources look up, keyed on their model and primary
+    key.
+
+    Every instance is an identity map meant to last a single request. It
+    can be backed by a ``shared`` :ref:`LRUCache`, which outlives requests.
+    Entities are passed through ``detach`` before they're stored there, e.g.
+    to copy them out of the current database session, and through ``adopt``
+    before they're used, e.g. to attach them to it.
+
+    """
+    def __init__(self, shared=None, adopt=None, detach=None):
+        self.shared = shared
+        self.adopt = adopt
+        self.detach = detach
+        self.identity_map = {}
+
+    def get(self, model, key, load):
+        """
+        Returns the entity of ``model`` identified by ``key``, calling
+        ``load(key)`` to fetch it if it isn't cached. Missing entities
+        aren't cached.
+        """
+        identity = (model, key)
+        try:
+            return self.identity_map[identity]
+        except KeyError:
+            pass
+
+        entity = None
+        if self.shared is not None:
+            entity = self.shared.get(identity)
+            if entity is not None and self.adopt is not None:
+                entity = self.adopt(entity)
+        if entity is None:
+            entity = load(key)
+            if entity is None:
+                return None
+            self._share(identity, entity)
+        self.identity_map[identity] = entity
+        return entity
+
+    def _share(self, identity, entity):
+        if self.shared is None:
+            return
+        if self.detach is not None:
+            entity = self.detach(entity)
+        self.shared.set(identity, entity)
+
+    def peek(self, model, key):
+        """
+        Returns the entity if it's in the identity map, without loading it.
+        """
+        return self.identity_map.get((model, key))
+
+    def add(self, model, key, entity):
+        self.identity_map[model, key] = entity
+        self._share((model, key), entity)
+
+    def invalidate(self, model, key):
+        """
+        Forgets the entity, in both the identity map and the shared cache.
+        """
+        self.identity_map.pop((model, key), None)
+        if self.shared is not None:
+            self.shared.delete((model, key))
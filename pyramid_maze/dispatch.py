@@ -0,0 +1,55 @@
+class Dispatcher(object):
+    """
+    Matches url paths against a graph in a single pass over their segments.
+
+    Paths alternate between the name of a node nested under the previous
+    one and a key, e.g. ``/Corporations/CR123/Departments/DP456``. The graph
+    is compiled into a segment trie: a table of transitions per node, from
+    the names of its children to them. Since every path reaching a node
+    shares its table, the trie is only ever as large as the graph. It's
+    compiled again whenever the graph changes.
+
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        self._version = None
+        self._transitions = None
+
+    def _compile(self):
+        transitions = {}
+        for node in self.graph.topological_order:
+            table = {}
+            for child in node.children:
+                table.setdefault(child.name, child)
+            transitions[node] = table
+        self._transitions = transitions
+        self._version = self.graph.version
+
+    def match(self, segments):
+        """
+        Matches the longest prefix of ``segments`` that follows the graph
+        from its root.
+
+        :return: A ``(chain, rest)`` tuple. ``chain`` lists a ``(node, key)``
+                 pair for every node along the prefix, whose ``key`` is
+                 ``None`` if the path ends with the node's name. ``rest`` is
+                 the segments past the prefix.
+        """
+        if self._version != self.graph.version:
+            self._compile()
+        transitions = self._transitions
+        table = transitions[self.graph.root]
+        chain = []
+        index = 0
+        length = len(segments)
+        while index < length:
+            node = table.get(segments[index])
+            if node is None:
+                break
+            if index + 1 < length:
+                chain.append((node, segments[index + 1]))
+            else:
+                chain.append((node, None))
+            index += 2
+            table = transitions[node]
+        return chain, segments[index:]
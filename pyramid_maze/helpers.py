@@ -1,69 +1,225 @@
 from cStringIO import StringIO
-from collections import Iterable
+from collections import deque, Iterable
+import json
 import re
+import time
 
+from . import instrumentation
 
-def traverse(start, on_visit):
+
+def traverse(start, on_visit, validate=True):
     """
-    Performs a depth-first serach on a tree.
+    Performs a breadth-first search on a tree.
 
     :param start: The starting node to begin the search
     :param on_visit: A callback function that will be invoked after visiting
                      a potential path.
 
                      If this method does not return a path, then the search
-                     will continue to exhaust the next path in the stack.
+                     will continue to exhaust the next path in the queue.
 
                      If a path is returned, it must satisfy a ``children``
                      iterable attribute. This attribute must yield the
-                     next paths to push on to the stack.
+                     next paths to push on to the queue.
+    :param validate: Asserts that every path returned by ``on_visit`` has an
+                     iterable ``children`` attribute. Callers that already
+                     guarantee it can skip the check.
     :return: None
     """
-    paths_to_explore = [start]
+    observed = instrumentation.observers
+    if observed:
+        started = time.time()
+    visits = 0
+    paths_to_explore = deque([start])
+    explore_next = paths_to_explore.popleft
+    explore_later = paths_to_explore.extend
     while paths_to_explore:
-        path = paths_to_explore.pop(0)
-        path = on_visit(path)
+        visits += 1
+        path = on_visit(explore_next())
         if not path:
             continue
 
-        assert isinstance(getattr(path, 'children'), Iterable), (
-            "Path %s must have a iterable attribute 'children'" % path
-        )
+        if validate:
+            assert isinstance(getattr(path, 'children'), Iterable), (
+                "Path %s must have a iterable attribute 'children'" % path
+            )
+
+        explore_later(path.children)
+
+    if observed:
+        instrumentation.emit('traverse', time.time() - started, visits=visits)
+
+
+class Lineage(object):
+    """
+    A path through a graph, represented by its last ``node`` and a pointer to
+    the lineage of its ``parent``.
+
+    Lineages of sibling nodes share their parent's lineage, so extending a
+    path costs constant time and memory instead of a copy of the whole path.
+    Iterating over a lineage yields its nodes starting from the root.
 
-        for child in path.children:
-            paths_to_explore.append(child)
+    """
+    __slots__ = ('node', 'parent', 'depth')
+
+    def __init__(self, node, parent=None):
+        self.node = node
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 1
+
+    @classmethod
+    def from_path(cls, path):
+        lineage = None
+        for node in path:
+            lineage = cls(node, lineage)
+        return lineage
+
+    @property
+    def children(self):
+        """
+        The lineages of the last node's children.
+        """
+        return (Lineage(child, self) for child in self.node.children)
+
+    def to_list(self):
+        path = [None] * self.depth
+        lineage = self
+        for index in xrange(self.depth - 1, -1, -1):
+            path[index] = lineage.node
+            lineage = lineage.parent
+        return path
+
+    def __len__(self):
+        return self.depth
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __getitem__(self, index):
+        if index == -1:
+            return self.node
+        return self.to_list()[index]
+
+    def __repr__(self):
+        return 'Lineage(%s)' % '/'.join(str(node) for node in self)
 
 
 def draw_tree(node,
               child_iter=lambda n: n.children,
-              text_str=str):
-    return _draw_tree(node, '', child_iter, text_str)
+              text_str=str,
+              max_depth=None):
+    """
+    Returns the tree under ``node`` drawn as text, see :func:`write_tree`.
+    """
+    buf = StringIO()
+    write_tree(node, buf, child_iter, text_str, max_depth)
+    return buf.getvalue()
 
 
-def _draw_tree(node, prefix, child_iter, text_str):
-    buf = StringIO()
+def write_tree(node, sink,
+               child_iter=lambda n: n.children,
+               text_str=str,
+               max_depth=None):
+    """
+    Draws the tree under ``node`` as text, one line per node, written to the
+    file-like ``sink`` as it goes.
+
+    Nodes shared by many parents are only drawn in full the first time
+    they're met with their children. Afterwards, they're drawn as a
+    back-reference, marked with ``(see above)``, without their children.
+    Nodes deeper than ``max_depth`` are left out, and their parent is marked
+    with ``...``.
+    """
+    write = sink.write
+    seen = set()
+    # the tree is walked depth first, with each node's prefix kept on the
+    # stack alongside it
+    nodes_to_draw = [(node, '', 0)]
+    while nodes_to_draw:
+        node, prefix, depth = nodes_to_draw.pop()
+
+        # check if root node
+        if prefix:
+            write(prefix[:-3])
+            write('  +--')
+        write(text_str(node))
+
+        children = list(child_iter(node))
+        if children and node in seen:
+            write(' (see above)\n')
+            continue
+        if children and max_depth is not None and depth >= max_depth:
+            write(' ...\n')
+            continue
+        # only nodes whose children are drawn can be referred back to
+        seen.add(node)
+        write('\n')
 
-    children = list(child_iter(node))
+        for index in xrange(len(children) - 1, -1, -1):
+            if index + 1 == len(children):
+                sub_prefix = prefix + '   '
+            else:
+                sub_prefix = prefix + '  |'
+            nodes_to_draw.append((children[index], sub_prefix, depth + 1))
 
-    # check if root node
-    if prefix:
-        buf.write(prefix[:-3])
-        buf.write('  +--')
-    buf.write(text_str(node))
-    buf.write('\n')
 
-    for index, child in enumerate(children):
+def walk(start, child_iter=lambda n: n.children):
+    """
+    Yields every node reachable from ``start`` once, breadth first, along
+    with the list of its children.
+    """
+    seen = {start}
+    nodes_to_visit = deque([start])
+    while nodes_to_visit:
+        node = nodes_to_visit.popleft()
+        children = list(child_iter(node))
+        yield node, children
+        for child in children:
+            if child not in seen:
+                seen.add(child)
+                nodes_to_visit.append(child)
 
-        if index + 1 == len(children):
-            sub_prefix = prefix + '   '
-        else:
-            sub_prefix = prefix + '  |'
 
-        buf.write(
-            _draw_tree(child, sub_prefix, child_iter, text_str)
-        )
+def _dot_id(text):
+    return '"%s"' % text.replace('\\', '\\\\').replace('"', '\\"')
 
-    return buf.getvalue()
+
+def write_dot(node, sink,
+              child_iter=lambda n: n.children,
+              text_str=str,
+              name='maze'):
+    """
+    Writes the graph under ``node`` to the file-like ``sink`` in the DOT
+    language of graphviz, one edge at a time.
+    """
+    write = sink.write
+    write('digraph %s {\n' % _dot_id(name))
+    for node, children in walk(node, child_iter):
+        parent = _dot_id(text_str(node))
+        write('  %s;\n' % parent)
+        for child in children:
+            write('  %s -> %s;\n' % (parent, _dot_id(text_str(child))))
+    write('}\n')
+
+
+def write_json(node, sink,
+               child_iter=lambda n: n.children,
+               text_str=str):
+    """
+    Writes the graph under ``node`` to the file-like ``sink`` as a JSON
+    object, ``{"root": name, "adjacency": {name: [child name, ...]}}``, one
+    node at a time.
+    """
+    write = sink.write
+    write('{"root": %s, "adjacency": {' % json.dumps(text_str(node)))
+    for index, (node, children) in enumerate(walk(node, child_iter)):
+        if index:
+            write(', ')
+        write('%s: %s' % (
+            json.dumps(text_str(node)),
+            json.dumps([text_str(child) for child in children])
+        ))
+    write('}}\n')
 
 
 def breadth_first_search(graph):
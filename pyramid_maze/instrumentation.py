@@ -0,0 +1,120 @@
+"""
+Optional instrumentation of the hot paths of routing.
+
+Observers are callables subscribed with :func:`subscribe`. Every event is
+reported to them as ``observer(event, duration, tags, counters)``, where
+``duration`` is in seconds (or ``None``), ``tags`` is a dict describing the
+event, and ``counters`` maps counter names to integers.
+
+Instrumented code checks :data:`observers` before measuring anything, so
+instrumentation costs next to nothing while no one is subscribed.
+
+"""
+from collections import defaultdict
+import socket
+import threading
+
+
+#: the subscribed observers
+observers = []
+
+
+def subscribe(observer):
+    observers.append(observer)
+    return observer
+
+
+def unsubscribe(observer):
+    observers.remove(observer)
+
+
+def emit(event, duration=None, tags=None, **counters):
+    for observer in list(observers):
+        observer(event, duration, tags or {}, counters)
+
+
+class Aggregator(object):
+    """
+    An observer that aggregates events in memory: how many times each one
+    occurred, their total and maximum duration, and the sum of each of
+    their counters.
+
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = {}
+
+    def __call__(self, event, duration, tags, counters):
+        with self._lock:
+            try:
+                aggregate = self._events[event]
+            except KeyError:
+                aggregate = self._events[event] = {
+                    'count': 0,
+                    'total_time': 0.0,
+                    'max_time': 0.0,
+                    'counters': defaultdict(int),
+                }
+            aggregate['count'] += 1
+            if duration is not None:
+                aggregate['total_time'] += duration
+                aggregate['max_time'] = max(aggregate['max_time'], duration)
+            for name, value in counters.iteritems():
+                aggregate['counters'][name] += value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(
+                (event, dict(aggregate, counters=dict(aggregate['counters'])))
+                for event, aggregate in self._events.iteritems()
+            )
+
+    def reset(self):
+        with self._lock:
+            self._events.clear()
+
+
+class StatsdFormatter(object):
+    """
+    Formats events as statsd lines: a timer for the duration, and a counter
+    per counter. Tags are appended to the metric names.
+    """
+
+    def __init__(self, prefix='pyramid_maze'):
+        self.prefix = prefix
+
+    def __call__(self, event, duration, tags, counters):
+        name = '.'.join(
+            [self.prefix, event] +
+            [str(tags[tag]) for tag in sorted(tags)]
+        )
+        lines = []
+        if duration is not None:
+            lines.append('%s:%.3f|ms' % (name, duration * 1000))
+        for counter in sorted(counters):
+            lines.append('%s.%s:%d|c' % (name, counter, counters[counter]))
+        return lines
+
+
+class StatsdObserver(object):
+    """
+    An observer that sends events to a statsd server over UDP, formatted by
+    :ref:`StatsdFormatter`. Sending is best effort, errors are ignored.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='pyramid_maze'):
+        self.address = (host, port)
+        self.format = StatsdFormatter(prefix)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, event, duration, tags, counters):
+        lines = self.format(event, duration, tags, counters)
+        if not lines:
+            return
+        try:
+            self._socket.sendto('\n'.join(lines), self.address)
+        except socket.error:
+            pass
+
+    def close(self):
+        self._socket.close()
@@ -1,85 +1,397 @@
-from itertools import imap
-from .helpers import traverse, draw_tree, convert_to_snake_case
+from array import array
+from collections import deque
+from heapq import heappush, heappop
+from itertools import count
+import sys
+import threading
+import time
+from weakref import WeakSet
 
+from . import instrumentation
+from .cache import LRUCache
+from .helpers import (
+    traverse, write_tree, write_dot, write_json, convert_to_snake_case,
+    Lineage
+)
+from .reachability import Reachability
 
-class Maze(object):
 
-    def __init__(self, graph):
-        self.graph = graph
+_missing = object()
+
+#: guards the edges of every graph, and what's derived from them, e.g. the
+#: routes memoized and compiled from a graph. graphs can share nodes, so
+#: they share the lock too
+_lock = threading.RLock()
 
-    def _optimal_path(self, is_solution):
-        possible_solutions = []
 
-        def on_visit(path):
-            if not is_solution(path):
-                # current path does not satisfy our constraints, so
-                # a possible solution might exist if the current path's
-                # last node has children, so we return it to be explored
-                return Node.decorate_leaves_with_lineage(path)
+class NoRouteFound(Exception):
+    """
+    Raised when no path from the root of a graph reaches a node while
+    visiting every node it was asked to include.
+    """
 
-            # if we've satisified our reason for traversal
-            # then we've hit a potential path!
-            possible_solutions.append(path)
+    def __init__(self, node, include=None):
+        self.node = node
+        self.include = frozenset(include or ())
+        msg = 'No route to %r' % node
+        if self.include:
+            msg += ' including %s' % ', '.join(
+                sorted(repr(n) for n in self.include)
+            )
+        super(NoRouteFound, self).__init__(msg)
+
+
+class CycleError(Exception):
+    """
+    Raised when an edge would make a graph cyclic. ``cycle`` lists the nodes
+    along the cycle, starting and ending with the same node.
+    """
 
-        traverse([self.graph.root], on_visit)
+    def __init__(self, cycle):
+        self.cycle = cycle
+        super(CycleError, self).__init__(
+            'Cycle: %s' % ' -> '.join(node.name for node in cycle)
+        )
 
-        # sort possible solutions on length, since weight is assumed to be one,
-        # return smallest.
-        possible_solutions.sort(cmp=lambda x, y: len(x) > len(y))
-        return possible_solutions[0]
+
+def _find_path(start, goal):
+    """
+    Returns a list of nodes along some path from ``start`` to ``goal``, or
+    ``None`` if ``goal`` can't be reached. Every node is visited once.
+    """
+    predecessors = {start: None}
+    nodes_to_visit = [start]
+    while nodes_to_visit:
+        node = nodes_to_visit.pop()
+        if node is goal:
+            path = []
+            while node is not None:
+                path.append(node)
+                node = predecessors[node]
+            path.reverse()
+            return path
+        for child in node.children:
+            if child not in predecessors:
+                predecessors[child] = node
+                nodes_to_visit.append(child)
+
+
+def _topological_sort(root):
+    """
+    Orders the nodes reachable from ``root`` so that every node comes before
+    its children, with Kahn's algorithm.
+
+    :raises CycleError: If the nodes can't be ordered.
+    """
+    in_degrees = {root: 0}
+    nodes = [root]
+    # ``nodes`` grows while it's iterated, which walks every edge once
+    for node in nodes:
+        for child in node.children:
+            if child in in_degrees:
+                in_degrees[child] += 1
+            else:
+                in_degrees[child] = 1
+                nodes.append(child)
+
+    order = []
+    ready = deque([root] if not in_degrees[root] else [])
+    while ready:
+        node = ready.popleft()
+        order.append(node)
+        for child in node.children:
+            in_degrees[child] -= 1
+            if not in_degrees[child]:
+                ready.append(child)
+
+    if len(order) < len(nodes):
+        # whatever couldn't be ordered sits on a cycle, or below one
+        for node in nodes:
+            if not in_degrees[node]:
+                continue
+            for child in node.children:
+                path = _find_path(child, node)
+                if path is not None:
+                    raise CycleError([node] + path)
+    return order
+
+
+class Maze(object):
+
+    def __init__(self, graph, cache_size=128):
+        self.graph = graph
+        #: memoized routes, keyed on the target node and the set of nodes to
+        #: include
+        self.cache = LRUCache(cache_size)
+        self._cache_version = graph.version
+
+    def _optimal_path(self, target, include, stats=None):
+        """
+        Dijkstra's search over ``(node, covered)`` states, where ``covered``
+        is a bitset of the ``include`` nodes already visited on the way to
+        ``node``.
+
+        The cost of a path is the sum of the weights of its edges, see
+        :meth:`Node.add_child`. States are settled in the order of their
+        ``(cost, hops)`` from the root, and in the order they were reached
+        when those tie. The first time ``target`` is settled with every
+        ``include`` node covered, the recorded predecessors describe the
+        cheapest path, and the one with the fewest hops among those. When
+        every edge weighs one, that's the path a breadth-first search would
+        find.
+
+        The search is pruned with the graph's :ref:`Reachability`: a node is
+        only expanded if it can still reach ``target`` and every ``include``
+        node that hasn't been covered yet.
+
+        :param stats: An optional dict, filled in with the number of
+                      states ``expanded`` and ``considered`` by the search.
+        :return: A list of nodes from ``self.graph.root`` to ``target``, or
+                 ``None`` if no such path exists.
+        """
+        reachability = self.graph.reachability
+        ids = reachability.ids
+        descendants = reachability.descendants
+        target_bit = 1 << ids[target]
+        required = 0
+        for node in include:
+            required |= 1 << ids[node]
+        goal = (target, required)
+        start = (self.graph.root, 0)
+
+        predecessors = {start: None}
+        best = {start: (0, 0)}
+        # ``seq`` breaks ties between equally good states, so they're
+        # settled in the order they were reached
+        seq = count()
+        states_to_explore = [(0, 0, next(seq), start)]
+        expanded = 0
+        path = None
+        while states_to_explore:
+            cost, hops, _, state = heappop(states_to_explore)
+            if best[state] != (cost, hops):
+                # a better way to reach the state has been found since
+                continue
+            expanded += 1
+            if state == goal:
+                path = []
+                while state is not None:
+                    path.append(state[0])
+                    state = predecessors[state]
+                path.reverse()
+                break
+
+            node, covered = state
+            # a node only counts towards ``include`` once it's been left,
+            # since the target must be the final hop of the path
+            covered |= required & 1 << ids[node]
+            needed = target_bit | required & ~covered
+            weights = node.weights
+            for child in node.children:
+                if descendants[ids[child]] & needed != needed:
+                    continue
+                next_state = (child, covered)
+                next_key = (cost + weights.get(child, 1), hops + 1)
+                known = best.get(next_state)
+                if known is None or next_key < known:
+                    best[next_state] = next_key
+                    predecessors[next_state] = state
+                    heappush(states_to_explore, next_key + (next(seq),
+                                                            next_state))
+
+        if stats is not None:
+            stats['considered'] = len(best)
+            stats['expanded'] = expanded
+        return path
 
     def route(self, node, include=None):
         """
         Given an directed acyclic graph, ``self.graph``, this method
-        will default to finding the shortest path to the desired
-        ``node``.
+        will default to finding the cheapest path to the desired
+        ``node``, see :meth:`_optimal_path`.
 
         If ``include`` is passed in, this method will try to find out
         the shortest topologically sorted path that includes a visit
         to all desired nodes in ``include``, eventually, ending up to
         the leaf ``node``.
 
+        Requests that can't be satisfied are rejected before searching,
+        see :meth:`Reachability.feasible`. Otherwise, each search costs
+        ``O((V + E) * 2^k * log(V * 2^k))`` at worst, where ``k`` is the
+        number of distinct nodes in ``include``. Results are memoized in
+        ``self.cache``. When the graph changes, only the routes it could
+        have changed are dropped, see :meth:`Graph.changed_since`.
+
+        :raises NoRouteFound: If no path satisfies the request.
+
+        """
+        observed = instrumentation.observers
+        if observed:
+            started = time.time()
+        if self.graph.version != self._cache_version:
+            self._prune()
+
+        key = (node, frozenset(include) if include else frozenset())
+        path = self.cache.get(key, _missing)
+        stats = {}
+        if path is _missing:
+            # the graph can't change between pruning the routes it
+            # invalidated and memoizing the one searched for, so a route
+            # can't outlive the version of the graph it was searched on
+            with _lock:
+                self._prune()
+                reachability = self.graph.reachability
+                if reachability.feasible(self.graph.root, node, key[1]):
+                    path = self._optimal_path(
+                        node, list(key[1]), stats if observed else None
+                    )
+                else:
+                    path = None
+                if path is not None:
+                    path = tuple(path)
+                self.cache.set(key, path)
+            stats['cache_miss'] = 1
+        else:
+            stats['cache_hit'] = 1
+        if observed:
+            instrumentation.emit('maze.route', time.time() - started, **stats)
+        if path is None:
+            raise NoRouteFound(node, key[1])
+        return list(path)
+
+    def _prune(self):
         """
-        include = set(include) if include else set()
+        Drops the memoized routes that the changes to the graph since they
+        were memoized could have changed.
+        """
+        with _lock:
+            version = self.graph.version
+            if version == self._cache_version:
+                return
+            changed = self.graph.changed_since(self._cache_version)
+            self.cache.prune(lambda key: key[0] in changed)
+            self._cache_version = version
+
+    def compile(self, includes=None):
+        """
+        Precomputes the optimal path to every node in ``self.graph``.
 
-        def is_solution(path):
-            last_node = path[-1]
-            # set of visited nodes in path
-            remaining_nodes = set(path[:-1])
+        :param includes: An optional iterable of ``include`` collections
+                         (see :meth:`route`). A route is precomputed for
+                         every node combined with each one of them.
+
+        :return: A :ref:`RouteTable`.
+        """
+        with _lock:
+            table = RouteTable(self, includes)
+            for node in self.graph.topological_order:
+                table.add_all(node)
+        return table
 
-            # see if there is any path in current_paths
-            # already statifies our requirements
-            return last_node == node and remaining_nodes.issuperset(include)
 
-        return self._optimal_path(is_solution)
+class RouteTable(object):
+    """
+    A lookup table of precomputed routes produced by :meth:`Maze.compile`.
 
+    Routes are keyed on their target node and the set of nodes they
+    include, and are stored as tuples so they can be shared safely.
+    Combinations that weren't precomputed are solved on first use, and
+    remembered from then on.
 
-class Node(object):
+    The table is kept up to date as edges are added to the graph: only the
+    routes to the nodes under the new edges are solved again, and the nodes
+    added along with them are precomputed like the others.
 
-    @classmethod
-    def decorate_leaves_with_lineage(cls, path):
+    """
+    def __init__(self, maze, includes=None):
+        self.maze = maze
+        self.includes = list(includes or [])
+        self._routes = {}
+        self._version = maze.graph.version
+
+    def __len__(self):
+        self._refresh()
+        return len(self._routes)
+
+    def _refresh(self):
+        graph = self.maze.graph
+        if graph.version == self._version:
+            return
+        with _lock:
+            version = graph.version
+            if version == self._version:
+                return
+            changed = graph.changed_since(self._version)
+            for key in [key for key in self._routes if key[0] in changed]:
+                self.add(*key)
+            for node in changed:
+                if (node, frozenset()) not in self._routes:
+                    self.add_all(node)
+            # only caught up once every route is solved again
+            self._version = version
+
+    def items(self):
         """
-        Decorates a node's children list with the full absolute path
-        to that node.
-
-        :param path: A list containing the last node seen, prepended with its
-                     lineage.
+        Returns a list of every ``((node, include), path)`` in the table,
+        where ``path`` is ``None`` when there's no route.
+        """
+        self._refresh()
+        with _lock:
+            return self._routes.items()
 
-        :return: A decorated :ref:`Node` that contains a modified children
-                 iterable attribute, where every child node is prepended with
-                 its lineage (in this case, the path).
+    def add_all(self, node):
+        """
+        Precomputes the routes to ``node``, alone and combined with each one
+        of :attr:`includes`.
         """
-        ln = path[-1]
-        decorated = cls(ln.name)
-        decorated.children = imap(lambda c: path[:] + [c], ln.children)
-        return decorated
+        self.add(node)
+        for include in self.includes:
+            self.add(node, include)
+
+    def add(self, node, include=None):
+        key = (node, frozenset(include) if include else frozenset())
+        # the route is stored before the graph can change again, so that
+        # the next refresh solves it again if it has to
+        with _lock:
+            try:
+                path = tuple(self.maze.route(node, key[1]))
+            except NoRouteFound:
+                # remember that there's no route, too
+                path = None
+            self._routes[key] = path
+        return path
 
-    def __init__(self, name=None):
-        self.name = name or convert_to_snake_case(self.__class__.__name__)
-        self.children = []
+    def route(self, node, include=None):
+        """
+        :raises NoRouteFound: If no path satisfies the request.
+        """
+        observed = instrumentation.observers
+        if observed:
+            started = time.time()
+        self._refresh()
+        include = frozenset(include) if include else frozenset()
+        try:
+            path = self._routes[node, include]
+        except KeyError:
+            path = self.add(node, include)
+            stats = {'cache_miss': 1}
+        else:
+            stats = {'cache_hit': 1}
+        if observed:
+            instrumentation.emit('route_table.route', time.time() - started,
+                                 **stats)
+        if path is None:
+            raise NoRouteFound(node, include)
+        return path
+
+
+class _NodeMixin(object):
+    """
+    What :ref:`Node` and :ref:`FrozenNode` have in common, given a ``name``
+    and ``children``.
 
-    def add_child(self, node):
-        self.children.append(node)
+    """
+    __slots__ = ()
 
     def find(self, child_name):
         if child_name == self.name:
@@ -94,22 +406,315 @@ class Node(object):
     def __repr__(self):
         return 'Node(%s)' % self.name
 
-    def draw(self):
-        print '\n' + draw_tree(self)
+    def draw(self, sink=None, max_depth=None):
+        """
+        Draws the tree under this node to ``sink``, or stdout, see
+        :func:`write_tree`.
+        """
+        sink = sink or sys.stdout
+        sink.write('\n')
+        write_tree(self, sink, max_depth=max_depth)
+        sink.write('\n')
+
+
+class _GraphMixin(object):
+    """
+    What :ref:`Graph` and :ref:`FrozenGraph` have in common, given a
+    ``root``. What's derived from the graph is cached in ``_order``,
+    ``_positions`` and ``_reachability``, which must be reset whenever the
+    graph changes.
+
+    """
+    def draw(self, sink=None, max_depth=None):
+        self.root.draw(sink, max_depth)
+
+    def write_dot(self, sink):
+        """
+        Writes the graph to ``sink`` in the DOT language, see
+        :func:`pyramid_maze.helpers.write_dot`.
+        """
+        write_dot(self.root, sink)
+
+    def write_json(self, sink):
+        """
+        Writes the graph's adjacency to ``sink`` as JSON, see
+        :func:`pyramid_maze.helpers.write_json`.
+        """
+        write_json(self.root, sink)
+
+    @property
+    def reachability(self):
+        """
+        The :ref:`Reachability` matrix of the graph. It's computed on first
+        use and kept until the graph changes.
+        """
+        if self._reachability is None:
+            self._reachability = Reachability(self.topological_order)
+        return self._reachability
+
+    @property
+    def topological_order(self):
+        """
+        A list of the graph's nodes, where every node comes before its
+        children. It's computed on first use and kept until the graph
+        changes.
+        """
+        if self._order is None:
+            self._order = _topological_sort(self.root)
+            self._positions = dict(
+                (node, position) for position, node in enumerate(self._order)
+            )
+        return self._order
+
+    @property
+    def edges(self):
+        """
+        Returns a list of every ``(parent, child)`` edge of the graph. Each
+        node's edges are listed once, however many paths lead to it.
+        """
+        return [
+            (node, child)
+            for node in self.topological_order for child in node.children
+        ]
 
 
-class Graph(object):
+class Node(_NodeMixin):
+
+    @classmethod
+    def decorate_leaves_with_lineage(cls, path):
+        """
+        Decorates a node's children with the full absolute path to that
+        node.
+
+        :param path: A :ref:`Lineage`, or a list containing the last node
+                     seen, prepended with its lineage.
+
+        :return: A :ref:`Lineage` whose ``children`` iterable attribute
+                 yields the lineage of every child node, sharing ``path``
+                 rather than copying it.
+        """
+        if isinstance(path, Lineage):
+            return path
+        return Lineage.from_path(path)
+
+    def __init__(self, name=None):
+        self.name = name or convert_to_snake_case(self.__class__.__name__)
+        self.children = []
+        #: the weight of the edge to each child, by child. edges weigh one
+        #: unless they were given another weight
+        self.weights = {}
+        #: the :ref:`Graph`s this node has been attached to. Several graphs
+        #: can share nodes, and they're all told about the edges added
+        self.graphs = WeakSet()
+
+    def add_child(self, node, weight=1):
+        """
+        Adds an edge to ``node``, weighing ``weight``. Weights are the cost
+        of following the edge, e.g. of looking up the parent of an entity,
+        and routes take the cheapest path, see :meth:`Maze.route`.
+
+        :raises ValueError: If ``weight`` is negative.
+        """
+        if weight < 0:
+            raise ValueError('Negative weight %r for %r' % (weight, node))
+        with _lock:
+            self.children.append(node)
+            for graph in list(self.graphs):
+                graph._edge_added(self, node)
+            self.weights[node] = weight
+
+
+class Graph(_GraphMixin):
     """
     Represents a collection of :ref:`Node`s. Acts as a fascade to operate
     on a set of nodes.
 
+    The graph must be acyclic: nodes that are already cyclic are rejected
+    when the graph is built, and so are edges that would close a cycle
+    once they're added.
+
+    :raises CycleError: If the nodes under ``root`` are cyclic.
+
     """
+    #: the most changes kept in :attr:`changes`. Anything that hasn't caught
+    #: up with the ones dropped since has to be computed again in full
+    max_changes = 1024
+
     def __init__(self, root):
         self.root = root
+        #: bumped every time an edge is added to the graph, so that anything
+        #: derived from it knows when it has gone stale
+        self.version = 0
+        #: the latest ``(parent, child)`` edges added or re-weighed, in order.
+        #: the first one was recorded after version ``changes_start``
+        self.changes = []
+        self.changes_start = 0
+        #: the moving average of the costs measured for each edge, and their
+        #: total, see :meth:`learn_weight`
+        self._costs = {}
+        self._costs_total = 0.0
         self._nodes = None
+        self._order = None
+        self._positions = None
+        self._reachability = None
+        #: maps node names to the nodes attached to this graph
+        self._index = {}
+        with _lock:
+            attached = self._attach(root)
+            try:
+                # orders the nodes, which validates that they're acyclic
+                self.topological_order
+            except CycleError:
+                # the nodes mustn't keep reporting to a graph that was
+                # rejected
+                for node in attached:
+                    node.graphs.discard(self)
+                raise
+
+    def __getitem__(self, name):
+        return self._index[name]
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def get(self, name, default=None):
+        """
+        Returns the node named ``name`` wherever it sits in the graph, or
+        ``default`` if there isn't one.
+        """
+        return self._index.get(name, default)
+
+    def _attach(self, node):
+        """
+        Marks every node reachable from ``node`` as a member of this graph,
+        so that adding a child to any of them is reported back to it.
+
+        :return: The nodes that weren't members yet.
+        """
+        attached = []
+        nodes_to_attach = [node]
+        while nodes_to_attach:
+            node = nodes_to_attach.pop()
+            if self in node.graphs:
+                continue
+            node.graphs.add(self)
+            self._index[node.name] = node
+            attached.append(node)
+            nodes_to_attach.extend(node.children)
+        return attached
+
+    def _edge_added(self, parent, child):
+        # only the nodes under ``child`` need to be searched for ``parent``
+        path = _find_path(child, parent)
+        if path is not None:
+            # the edge was just appended, take it back
+            parent.children.pop()
+            raise CycleError([parent] + path)
+        if self not in child.graphs:
+            # the nodes joining the graph may be cyclic among themselves
+            try:
+                _topological_sort(child)
+            except CycleError:
+                parent.children.pop()
+                raise
+        attached = self._attach(child)
+        self._changed(parent, child)
+        # whatever was derived from the graph is updated in place, rather
+        # than computed again from scratch
+        if self._nodes is not None:
+            self._nodes.update(attached)
+        if self._order is not None and (
+            attached or self._positions[parent] > self._positions[child]
+        ):
+            self._order = None
+        if self._reachability is not None:
+            self._reachability.add_edge(parent, child)
+
+    def _changed(self, parent, child):
+        self.changes.append((parent, child))
+        self.version += 1
+        if len(self.changes) > self.max_changes:
+            # the oldest half is dropped, so that it's only ever done once
+            # in a while
+            dropped = len(self.changes) // 2
+            del self.changes[:dropped]
+            self.changes_start += dropped
+
+    def changed_since(self, version):
+        """
+        Returns the set of nodes whose routes may have changed since the
+        graph's ``version``. A route can only have changed by going through
+        an edge added or re-weighed since, so those are the nodes under the
+        edges' children. If the changes since ``version`` were dropped, see
+        :attr:`max_changes`, every node is returned.
+        """
+        with _lock:
+            if version < self.changes_start:
+                return set(self.nodes)
+            reachability = self.reachability
+            changed = set()
+            for parent, child in self.changes[version - self.changes_start:]:
+                if child not in changed:
+                    changed |= reachability.descendants_of(child)
+            return changed
+
+    def set_weight(self, parent, child, weight):
+        """
+        Changes the weight of the edge from ``parent`` to ``child``. It's
+        recorded like an edge being added, so that the routes through it
+        are found again.
 
-    def draw(self):
-        self.root.draw()
+        :raises ValueError: If there's no such edge, or ``weight`` is
+                            negative.
+        """
+        if child not in parent.children:
+            raise ValueError('No edge from %r to %r' % (parent, child))
+        if weight < 0:
+            raise ValueError('Negative weight %r for %r' % (weight, child))
+        with _lock:
+            parent.weights[child] = weight
+            self._changed(parent, child)
+
+    def learn_weight(self, parent, child, cost, alpha=0.2, tolerance=0.25):
+        """
+        Learns the weight of the edge from ``parent`` to ``child`` from a
+        measured ``cost``, e.g. the latency of looking up a parent entity.
+        Costs are averaged per edge, with an exponentially weighted moving
+        average.
+
+        Measured costs are in whatever unit they were measured in, while
+        weights are relative to the default weight of one. So an edge's
+        weight is learned as its average cost relative to the mean of the
+        averages of every edge measured: measured edges that cost as much
+        as usual weigh one, like the edges that were never measured.
+
+        The edge is only re-weighed once its learned weight drifts away
+        from its weight by more than ``tolerance``, relatively, so that
+        noise doesn't keep the routes through it from being memoized.
+
+        :return: Whether the edge was re-weighed.
+        """
+        # requests learn weights concurrently, while others read routes
+        with _lock:
+            key = (parent, child)
+            average = self._costs.get(key)
+            if average is None:
+                self._costs_total += cost
+                average = cost
+            else:
+                change = alpha * (cost - average)
+                self._costs_total += change
+                average += change
+            self._costs[key] = average
+            mean = self._costs_total / len(self._costs)
+            if mean <= 0:
+                return False
+            learned = average / mean
+            weight = parent.weights.get(child, 1)
+            if abs(learned - weight) <= tolerance * weight:
+                return False
+            self.set_weight(parent, child, learned)
+            return True
 
     @property
     def nodes(self):
@@ -122,9 +727,138 @@ class Graph(object):
         uniq_nodes = set()
 
         def on_visit(node):
+            # shared nodes are only expanded the first time they're seen
+            if node in uniq_nodes:
+                return
             uniq_nodes.add(node)
             return node
 
-        traverse(self.root, on_visit)
+        traverse(self.root, on_visit, validate=False)
         self._nodes = uniq_nodes
         return self._nodes
+
+    def freeze(self):
+        """
+        Returns a compact, read-only copy of this graph, see
+        :ref:`FrozenGraph`.
+        """
+        ids = {self.root: 0}
+        ordered_nodes = [self.root]
+        offsets = array('i', [0])
+        targets = array('i')
+        weights = array('d')
+        # ``ordered_nodes`` grows while it's iterated, which numbers the
+        # nodes in breadth-first order
+        for node in ordered_nodes:
+            for child in node.children:
+                if child not in ids:
+                    ids[child] = len(ordered_nodes)
+                    ordered_nodes.append(child)
+                targets.append(ids[child])
+                weights.append(node.weights.get(child, 1))
+            offsets.append(len(targets))
+        return FrozenGraph(
+            [node.name for node in ordered_nodes], offsets, targets, weights
+        )
+
+
+class FrozenNode(_NodeMixin):
+    """
+    A lightweight handle to node ``id`` of a :ref:`FrozenGraph`. Its
+    children are read out of the graph's adjacency arrays on demand.
+
+    """
+    __slots__ = ('graph', 'id', 'name')
+
+    def __init__(self, graph, id, name):
+        self.graph = graph
+        self.id = id
+        self.name = name
+
+    @property
+    def children(self):
+        graph = self.graph
+        handles = graph._handles
+        targets = graph.targets
+        return [
+            handles[targets[index]]
+            for index in xrange(graph.offsets[self.id],
+                                graph.offsets[self.id + 1])
+        ]
+
+    @property
+    def weights(self):
+        graph = self.graph
+        if graph.weights is None:
+            return {}
+        handles = graph._handles
+        targets = graph.targets
+        return dict(
+            (handles[targets[index]], graph.weights[index])
+            for index in xrange(graph.offsets[self.id],
+                                graph.offsets[self.id + 1])
+        )
+
+    def add_child(self, node, weight=1):
+        raise TypeError('%r belongs to a frozen graph' % self)
+
+
+class FrozenGraph(_GraphMixin):
+    """
+    A read-only graph whose nodes are numbered ``0..n-1``, with the root
+    numbered ``0``. Adjacency is kept in compressed sparse row form: the
+    children of node ``i`` are ``targets[offsets[i]:offsets[i + 1]]``, and
+    the edges to them weigh ``weights[offsets[i]:offsets[i + 1]]``. Without
+    ``weights``, every edge weighs one.
+
+    It quacks like a :ref:`Graph`, so :ref:`Maze` and ``traverse`` work on
+    it unchanged, with :ref:`FrozenNode` handles standing in for nodes.
+
+    """
+    #: a frozen graph never changes
+    version = 0
+    changes = ()
+
+    def __init__(self, names, offsets, targets, weights=None):
+        self.names = names
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        self._handles = [
+            FrozenNode(self, id, name) for id, name in enumerate(names)
+        ]
+        self._index = dict(
+            (handle.name, handle) for handle in self._handles
+        )
+        self._order = None
+        self._positions = None
+        self._reachability = None
+
+    @property
+    def root(self):
+        return self._handles[0]
+
+    @property
+    def nodes(self):
+        return frozenset(self._handles)
+
+    def __len__(self):
+        return len(self._handles)
+
+    def __getitem__(self, name):
+        return self._index[name]
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def get(self, name, default=None):
+        return self._index.get(name, default)
+
+    def node(self, id):
+        return self._handles[id]
+
+    def changed_since(self, version):
+        return set()
+
+    def freeze(self):
+        return self
@@ -0,0 +1,184 @@
+from array import array
+
+
+class Reachability(object):
+    """
+    All-pairs reachability and shortest distances between the nodes of a
+    graph, computed with a breadth-first search from every node.
+
+    Every node is numbered by its position in :attr:`nodes`. Reachability is
+    kept as bitsets: bit ``j`` of ``descendants[i]`` is set when node ``j``
+    can be reached from node ``i``, and bit ``i`` of ``ancestors[j]`` is its
+    transpose. A node always reaches itself. ``distances[i][j]`` is the
+    least number of hops from node ``i`` to node ``j``, or ``-1`` if there's
+    no path between them.
+
+    """
+    def __init__(self, nodes):
+        self.nodes = list(nodes)
+        self.ids = dict((node, id) for id, node in enumerate(self.nodes))
+        count = len(self.nodes)
+        self.descendants = [0] * count
+        self.ancestors = [0] * count
+        self.distances = []
+        for node in self.nodes:
+            self._search(node)
+
+    def _search(self, node):
+        """
+        Fills in the row of ``node``, and its bit in the ancestors of every
+        node it reaches, with a breadth-first search. Rows are filled in the
+        order of the nodes' ids.
+        """
+        source = self.ids[node]
+        distances = array('i', [-1]) * len(self.nodes)
+        distances[source] = 0
+        reached = 1 << source
+        frontier = [node]
+        depth = 0
+        while frontier:
+            depth += 1
+            next_frontier = []
+            for parent in frontier:
+                for child in parent.children:
+                    target = self.ids[child]
+                    if reached >> target & 1:
+                        continue
+                    reached |= 1 << target
+                    distances[target] = depth
+                    self.ancestors[target] |= 1 << source
+                    next_frontier.append(child)
+            frontier = next_frontier
+        self.ancestors[source] |= 1 << source
+        self.descendants[source] = reached
+        self.distances.append(distances)
+
+    def add_edge(self, parent, child):
+        """
+        Updates the matrices after an edge from ``parent`` to ``child`` was
+        added, which must have kept the graph acyclic.
+
+        Nodes under ``child`` that are new to the matrices are numbered
+        after the existing ones, and searched from. Otherwise, only the rows
+        of the ancestors of ``parent`` are updated, and only in the columns
+        of the descendants of ``child``.
+        """
+        ids = self.ids
+        new_nodes = []
+        nodes_to_number = [child]
+        while nodes_to_number:
+            node = nodes_to_number.pop()
+            if node in ids:
+                continue
+            ids[node] = len(self.nodes)
+            self.nodes.append(node)
+            new_nodes.append(node)
+            nodes_to_number.extend(node.children)
+        if new_nodes:
+            padding = array('i', [-1]) * len(new_nodes)
+            for distances in self.distances:
+                distances.extend(padding)
+            self.descendants.extend([0] * len(new_nodes))
+            self.ancestors.extend([0] * len(new_nodes))
+            for node in new_nodes:
+                self._search(node)
+
+        parent_id, child_id = ids[parent], ids[child]
+        ancestor_bits = self.ancestors[parent_id]
+        descendant_bits = self.descendants[child_id]
+        descendant_ids = self._ids_in(descendant_bits)
+        from_child = self.distances[child_id]
+        for ancestor in self._ids_in(ancestor_bits):
+            self.descendants[ancestor] |= descendant_bits
+            distances = self.distances[ancestor]
+            to_child = distances[parent_id] + 1
+            for descendant in descendant_ids:
+                distance = to_child + from_child[descendant]
+                known = distances[descendant]
+                if known < 0 or distance < known:
+                    distances[descendant] = distance
+        for descendant in descendant_ids:
+            self.ancestors[descendant] |= ancestor_bits
+
+    def _ids_in(self, bits):
+        return [id for id in xrange(len(self.nodes)) if bits >> id & 1]
+
+    def _nodes_in(self, bits):
+        return set(
+            node for id, node in enumerate(self.nodes) if bits >> id & 1
+        )
+
+    def reaches(self, node, other):
+        """
+        Whether ``other`` can be reached by following edges from ``node``.
+        """
+        return bool(self.descendants[self.ids[node]] >> self.ids[other] & 1)
+
+    def distance(self, node, other):
+        """
+        The least number of hops from ``node`` to ``other``, or ``None`` if
+        it can't be reached.
+        """
+        distance = self.distances[self.ids[node]][self.ids[other]]
+        return distance if distance >= 0 else None
+
+    def descendants_of(self, node):
+        return self._nodes_in(self.descendants[self.ids[node]])
+
+    def ancestors_of(self, node):
+        return self._nodes_in(self.ancestors[self.ids[node]])
+
+    def depths(self, root):
+        """
+        Maps every node reachable from ``root`` to its shortest nesting
+        depth under it.
+        """
+        distances = self.distances[self.ids[root]]
+        return dict(
+            (node, distances[id])
+            for id, node in enumerate(self.nodes) if distances[id] >= 0
+        )
+
+    def feasible(self, root, target, include=None):
+        """
+        Whether some path from ``root`` to ``target`` visits every node of
+        ``include`` before reaching ``target``.
+
+        On an acyclic graph it does exactly when ``root`` reaches every
+        ``include`` node, each of them reaches ``target`` in at least one
+        hop, and they can all be ordered along a single path. Nodes that
+        aren't in the graph can't be reached.
+        """
+        ids = self.ids
+        include = set(include or ())
+        if target not in ids or not all(node in ids for node in include):
+            return False
+        descendants = self.descendants
+        target_id = ids[target]
+        if not descendants[ids[root]] >> target_id & 1:
+            return False
+
+        include_ids = [ids[node] for node in include]
+        for index, id in enumerate(include_ids):
+            if self.distances[id][target_id] < 1:
+                return False
+            if not descendants[ids[root]] >> id & 1:
+                return False
+            for other in include_ids[index + 1:]:
+                if not (descendants[id] >> other & 1 or
+                        descendants[other] >> id & 1):
+                    return False
+        return True
+
+    def to_numpy(self):
+        """
+        Returns the reachability and distance matrices as ``numpy`` arrays,
+        for bulk queries. Requires ``numpy`` to be installed.
+        """
+        import numpy
+
+        count = len(self.nodes)
+        distances = numpy.array(
+            [list(row) for row in self.distances], dtype=numpy.int32
+        ).reshape(count, count)
+        return distances >= 0, distances
@@ -0,0 +1,124 @@
+from collections import OrderedDict
+import sys
+
+
+class Resolved(object):
+    """
+    A result that's available already. It quacks like the ``AsyncResult``
+    returned by a thread pool, for resolvers that don't have one.
+
+    """
+    def __init__(self, value=None, exc_info=None):
+        self._value = value
+        self._exc_info = exc_info
+
+    def ready(self):
+        return True
+
+    def successful(self):
+        return self._exc_info is None
+
+    def wait(self, timeout=None):
+        pass
+
+    def get(self, timeout=None):
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._value
+
+
+class ParentResolver(object):
+    """
+    Resolves the entities along a route, from the entity it leads to up to
+    the root, through a ``lookup(entities, node)`` callable that returns the
+    parent under ``node`` of each one of ``entities``, in order.
+
+    Each hop of a route depends on the one below it, so the hops of a route
+    are resolved in turn, with a single lookup per hop for every entity
+    being resolved. Independent routes can be resolved concurrently on a
+    thread pool with :meth:`submit`, so that their lookups overlap each
+    other's latency rather than add up.
+
+    :param lookup: The lookup callable. It's called from the pool's threads,
+                   so it must be safe to call from any thread.
+    :param pool: An optional ``multiprocessing.pool.ThreadPool``. Without
+                 one, submitted work is done by the calling thread.
+    :param cache: An optional dict of parents already resolved, keyed on
+                  ``key(entity, node)``. It's shared by every route resolved,
+                  concurrently or not.
+    :param key: Returns the cache key of the parent of ``entity`` under
+                ``node``.
+
+    """
+    def __init__(self, lookup, pool=None, cache=None, key=None):
+        self.lookup = lookup
+        self.pool = pool
+        self.cache = {} if cache is None else cache
+        self.key = key or (lambda entity, node: (entity, node))
+
+    def resolve(self, entities, path_nodes):
+        """
+        Resolves the parents of each one of ``entities`` along ``path_nodes``,
+        a route from the root to the node of the entities.
+
+        :return: A list with the lineage of each entity, starting with the
+                 entity itself. A lineage stops short at the first parent
+                 that couldn't be resolved.
+        """
+        lineages = [[entity] for entity in entities]
+        for node in reversed(path_nodes[:-1]):
+            unresolved = OrderedDict()
+            for lineage in lineages:
+                entity = lineage[-1]
+                if not entity:
+                    continue
+                key = self.key(entity, node)
+                try:
+                    lineage.append(self.cache[key])
+                except KeyError:
+                    unresolved.setdefault(key, []).append(lineage)
+            if not unresolved:
+                continue
+            parents = self.lookup(
+                [waiting[0][-1] for waiting in unresolved.itervalues()], node
+            )
+            for (key, waiting), parent in zip(unresolved.iteritems(),
+                                              parents):
+                # concurrent resolutions may both look up a parent that
+                # neither had cached, which is harmless
+                self.cache[key] = parent
+                for lineage in waiting:
+                    lineage.append(parent)
+        return lineages
+
+    def submit(self, func, *args):
+        """
+        Calls ``func(*args)`` on the pool.
+
+        :return: An ``AsyncResult``, or a :ref:`Resolved` result if there's
+                 no pool.
+        """
+        if self.pool is not None:
+            return self.pool.apply_async(func, args)
+        try:
+            return Resolved(func(*args))
+        except Exception:
+            return Resolved(exc_info=sys.exc_info())
+
+    def resolve_async(self, entities, path_nodes):
+        """
+        Like :meth:`resolve`, but done on the pool.
+        """
+        return self.submit(self.resolve, entities, path_nodes)
+
+    def resolve_many(self, batches):
+        """
+        Resolves many ``(entities, path_nodes)`` batches concurrently.
+
+        :return: The result of :meth:`resolve` for each batch, in order.
+        """
+        results = [
+            self.resolve_async(entities, path_nodes)
+            for entities, path_nodes in batches
+        ]
+        return [result.get() for result in results]
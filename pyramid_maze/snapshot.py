@@ -0,0 +1,289 @@
+"""
+Compact binary snapshots of a graph and its compiled routes.
+
+A snapshot is written once, e.g. by the first process that scans the
+application, and read by every other one through a memory map instead of
+building the graph and compiling its routes again. Snapshots are keyed, and
+a snapshot whose key doesn't match is ignored, see :func:`modules_key`.
+
+The layout is a header followed by sections of native ``int32`` arrays:
+
+- the byte offsets of each node's name in the names section
+- the graph's CSR ``offsets`` and ``targets``, see :ref:`FrozenGraph`
+- one ``(target, include count, include start, path start, path length)``
+  entry per route, sorted on the target and the sorted include ids. The
+  includes and the path are stored in the pool. A path length of ``-1``
+  records that there's no route
+- the pool
+- the weights of the edges, as native doubles
+- the utf-8 encoded names of the nodes
+
+"""
+from array import array
+import hashlib
+import inspect
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+from . import instrumentation
+from .maze import Maze, FrozenGraph, NoRouteFound
+
+
+MAGIC = 'MAZE'
+FORMAT = 2
+
+_header = struct.Struct('=4sI20s11i')
+_entry = struct.Struct('=5i')
+
+_missing = object()
+
+
+def modules_key(modules):
+    """
+    Hashes the source of ``modules``, so that a snapshot taken before any
+    of them changed is never loaded.
+    """
+    digest = hashlib.sha1(str(FORMAT))
+    for module in modules:
+        path = inspect.getsourcefile(module) or module.__file__
+        with open(path, 'rb') as fp:
+            digest.update(fp.read())
+    return digest.digest()
+
+
+def dumps(graph, routes, key):
+    """
+    Serializes ``graph`` and the :ref:`RouteTable` of its ``routes``.
+
+    :return: The snapshot, as a string.
+    """
+    frozen = graph.freeze()
+    ids = dict((name, id) for id, name in enumerate(frozen.names))
+
+    entries = []
+    pool = array('i')
+    for (node, include), path in routes.items():
+        include_ids = sorted(ids[n.name] for n in include)
+        entries.append((ids[node.name], include_ids, path))
+    entries.sort(key=lambda entry: (entry[0], entry[1]))
+
+    table = array('i')
+    for target, include_ids, path in entries:
+        include_start = len(pool)
+        pool.extend(include_ids)
+        path_start = len(pool)
+        if path is None:
+            path_length = -1
+        else:
+            path_length = len(path)
+            pool.extend(ids[n.name] for n in path)
+        table.extend(
+            (target, len(include_ids), include_start, path_start, path_length)
+        )
+
+    names = []
+    name_offsets = array('i', [0])
+    for name in frozen.names:
+        names.append(name.encode('utf-8'))
+        name_offsets.append(name_offsets[-1] + len(names[-1]))
+
+    weights = frozen.weights
+    if weights is None:
+        weights = array('d', [1]) * len(frozen.targets)
+    sections = [
+        name_offsets, frozen.offsets, frozen.targets, table, pool, weights
+    ]
+    offsets = []
+    position = _header.size
+    for section in sections:
+        offsets.append(position)
+        position += len(section) * section.itemsize
+    offsets.append(position)
+
+    header = _header.pack(
+        MAGIC, FORMAT, key, len(frozen), len(frozen.targets), len(entries),
+        len(pool), *offsets
+    )
+    return ''.join(
+        [header] + [section.tostring() for section in sections] + names
+    )
+
+
+def dump(path, graph, routes, key):
+    """
+    Writes a snapshot to ``path``. The file is replaced atomically, so
+    readers never see a partial snapshot.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(dumps(graph, routes, key))
+        os.rename(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def load(path, key):
+    """
+    Memory maps the snapshot at ``path``.
+
+    :return: A :ref:`Snapshot`, or ``None`` if there's no snapshot at
+             ``path`` or it was taken with a different ``key``.
+    """
+    try:
+        with open(path, 'rb') as fp:
+            buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+    return Snapshot.from_buffer(buf, key)
+
+
+def publish(graph, routes, key=''):
+    """
+    Copies a snapshot into a read-only memory map of an unlinked temporary
+    file. Its pages live in the page cache, so processes forked afterwards,
+    e.g. pre-fork workers, all read the same routes in place rather than
+    each building a copy of their own.
+
+    :return: A :ref:`Snapshot` of the memory map.
+    """
+    with tempfile.TemporaryFile() as fp:
+        fp.write(dumps(graph, routes, key))
+        fp.flush()
+        buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    return Snapshot(buf)
+
+
+class Snapshot(object):
+    """
+    A snapshot read from a buffer, e.g. a memory map. It provides the
+    snapshotted :attr:`graph`, and its :attr:`routes`.
+
+    """
+    def __init__(self, buf):
+        self.buf = buf
+        (_, _, self.key, self.node_count, self.edge_count, self.route_count,
+         self.pool_count, names_index, csr_offsets, csr_targets, entries,
+         pool, weights, names) = _header.unpack_from(buf)
+        self._entries = entries
+        self._pool = pool
+
+        name_offsets = struct.unpack_from(
+            '=%di' % (self.node_count + 1), buf, names_index
+        )
+        node_names = [
+            buf[names + start:names + end].decode('utf-8')
+            for start, end in zip(name_offsets, name_offsets[1:])
+        ]
+        offsets = array('i', buf[csr_offsets:csr_targets])
+        targets = array('i', buf[csr_targets:entries])
+        self.graph = FrozenGraph(
+            node_names, offsets, targets, array('d', buf[weights:names])
+        )
+        self.routes = SnapshotRouteTable(self)
+
+    @classmethod
+    def from_buffer(cls, buf, key=None):
+        """
+        :return: The snapshot in ``buf``, or ``None`` if ``buf`` doesn't hold
+                 a snapshot taken with ``key``.
+        """
+        if len(buf) < _header.size:
+            return None
+        magic, format, snapshot_key = _header.unpack_from(buf)[:3]
+        if magic != MAGIC or format != FORMAT:
+            return None
+        if key is not None and snapshot_key != key:
+            return None
+        return cls(buf)
+
+    def _ints(self, start, count):
+        return struct.unpack_from(
+            '=%di' % count, self.buf, self._pool + start * 4
+        )
+
+    def entry(self, index):
+        return _entry.unpack_from(
+            self.buf, self._entries + index * _entry.size
+        )
+
+    def find(self, target, include_ids):
+        """
+        Binary searches the routes for the one to node ``target`` that
+        includes the nodes ``include_ids``, straight from the buffer.
+
+        :return: The ids of the nodes along the route, ``None`` if there's
+                 no route, or ``_missing`` if it wasn't snapshotted.
+        """
+        key = (target, tuple(sorted(include_ids)))
+        low, high = 0, self.route_count
+        while low < high:
+            middle = (low + high) // 2
+            entry_target, count, include_start, path_start, length = (
+                self.entry(middle)
+            )
+            entry_key = (entry_target, self._ints(include_start, count))
+            if entry_key < key:
+                low = middle + 1
+            elif entry_key > key:
+                high = middle
+            elif length < 0:
+                return None
+            else:
+                return self._ints(path_start, length)
+        return _missing
+
+
+class SnapshotRouteTable(object):
+    """
+    A :ref:`RouteTable` whose routes are read from a :ref:`Snapshot`. Routes
+    that weren't snapshotted are solved on the snapshot's graph on first
+    use, and remembered by this table.
+
+    """
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.maze = Maze(snapshot.graph)
+        self._extra = {}
+
+    def __len__(self):
+        return self.snapshot.route_count + len(self._extra)
+
+    def route(self, node, include=None):
+        """
+        :raises NoRouteFound: If no path satisfies the request.
+        """
+        observed = instrumentation.observers
+        if observed:
+            started = time.time()
+        include = frozenset(include) if include else frozenset()
+        ids = self.snapshot.find(node.id, [n.id for n in include])
+        if ids is None:
+            path = None
+            stats = {'cache_hit': 1}
+        elif ids is not _missing:
+            node_at = self.snapshot.graph.node
+            path = tuple(node_at(id) for id in ids)
+            stats = {'cache_hit': 1}
+        else:
+            try:
+                path = self._extra[node, include]
+            except KeyError:
+                try:
+                    path = tuple(self.maze.route(node, include))
+                except NoRouteFound:
+                    path = None
+                self._extra[node, include] = path
+                stats = {'cache_miss': 1}
+            else:
+                stats = {'cache_hit': 1}
+        if observed:
+            instrumentation.emit('route_table.route', time.time() - started,
+                                 **stats)
+        if path is None:
+            raise NoRouteFound(node, include)
+        return path
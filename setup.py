@@ -43,6 +43,9 @@ extras_require = {
         'tox',
         'mock >=1.0,<2.0',
     ],
+    'benchmarks': [
+        'pytest-benchmark',
+    ],
 }
 
 scripts = []
@@ -61,7 +64,9 @@ class PyTest(TestCommand):
         pytest.main(self.test_args)
 
 
-packages = setuptools.find_packages('.', exclude=('tests', 'tests.*'))
+packages = setuptools.find_packages(
+    '.', exclude=('tests', 'tests.*', 'benchmarks', 'benchmarks.*')
+)
 setuptools.setup(
     name='pyramid_maze',
     version=version,
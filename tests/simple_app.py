@@ -1,17 +1,31 @@
 from inspect import getmembers, ismethod
+from multiprocessing.pool import ThreadPool
 import os
+import sys
+import threading
+import time
+from weakref import WeakSet
 
 from pyramid.config import Configurator
+from pyramid.decorator import reify
+from pyramid.httpexceptions import HTTPNotFound
 from pyramid.renderers import render_to_response
+from pyramid.settings import asbool
 from pyramid.threadlocal import get_current_registry
+from pyramid.traversal import (
+    ResourceTreeTraverser, traversal_path_info, VH_ROOT_KEY
+)
 from sqlalchemy import (
-    create_engine, types as satype, schema as sa, orm as saorm
+    create_engine, event, types as satype, schema as sa, orm as saorm
 )
 from sqlalchemy.inspection import inspect
 from sqlalchemy.ext.declarative import declarative_base
 import venusian
 
-from pyramid_maze import Node, Graph, Maze
+from pyramid_maze import (
+    Node, Graph, Maze, EntityCache, LRUCache, ParentResolver,
+    Dispatcher, instrumentation, snapshot
+)
 
 
 engine = create_engine('sqlite:///%s/pymaze.db' %
@@ -20,12 +34,26 @@ Base = declarative_base()
 
 
 class RelationFetchMixin(object):
+
+    @classmethod
+    def relation_keys(cls):
+        """
+        Maps the table names of the model's relations to the keys of the
+        relationships that load them. It's computed once per model.
+        """
+        try:
+            return cls.__dict__['_relation_keys']
+        except KeyError:
+            relation_keys = {}
+            for rel in inspect(cls).relationships.values():
+                relation_keys.setdefault(rel.target.name, rel.key)
+            cls._relation_keys = relation_keys
+            return relation_keys
+
     def get_relation(self, target_relation):
-        target_relation = target_relation.lower()
-        relationships = inspect(self.__class__).relationships
-        for rel in relationships.values():
-            if rel.table.name == target_relation:
-                return getattr(self, rel.key)
+        key = self.relation_keys().get(target_relation.lower())
+        if key:
+            return getattr(self, key)
 
 
 class CorporationsModel(Base, RelationFetchMixin):
@@ -62,9 +90,25 @@ ses = Session()
 Base.query = Session.query_property()
 
 
-def nest_under(resource):
+def nest_under(resource, weight=1):
+    """
+    Nests the decorated resource under ``resource``. ``weight`` is the cost
+    of looking up the parent of one of its entities, relative to the other
+    resources', see :meth:`Node.add_child`.
+    """
 
     def callback(scanner, sub_resource_name, subresource):
+        try:
+            resources = getattr(scanner.config.registry, 'maze_resources')
+        except AttributeError:
+            resources = scanner.config.registry.maze_resources = {}
+        resources[resource.__name__] = resource
+        resources[sub_resource_name] = subresource
+
+        # the graph was loaded from a snapshot, no need to build it
+        if getattr(scanner.config.registry, 'maze_snapshot', None):
+            return
+
         try:
             graph = getattr(scanner.config.registry, 'graph')
         except AttributeError:
@@ -72,14 +116,14 @@ def nest_under(resource):
             graph = Graph(n)
             scanner.config.registry.graph = graph
         else:
-            n = graph.root.find(resource.__name__)
+            n = graph.get(resource.__name__)
 
         if sub_resource_name in resource.nested_resources:
-            sub_node = graph.root.find(sub_resource_name)
+            sub_node = graph.get(sub_resource_name)
             if sub_node:
-                n.add_child(sub_node)
+                n.add_child(sub_node, weight)
             else:
-                n.add_child(Node(sub_resource_name))
+                n.add_child(Node(sub_resource_name), weight)
 
     def wrapped(nested_cls):
         resource.nested_resources[nested_cls.__name__] = nested_cls
@@ -90,12 +134,37 @@ def nest_under(resource):
     return wrapped
 
 
+class DispatchTable(dict):
+    """
+    A read-only mapping of the resources nested under an item of a resource,
+    by name, see :func:`freeze_dispatch_tables`.
+
+    """
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('Dispatch tables are read-only')
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+
+def freeze_dispatch_tables(registry):
+    """
+    Freezes what's nested under every scanned resource into its
+    ``dispatch_table``, once the configuration is committed.
+    """
+    for resource in registry.maze_resources.itervalues():
+        resource.dispatch_table = DispatchTable(resource.nested_resources)
+
+
 class ResourcePredicate(object):
     """
     This resource predicate works as a way to choose the correct view callable
     where it is required to distinguish between operating on a resource item
     rather than a collection.
 
+    Only the views with a ``view_config`` of their own need it: the others
+    are picked from their controller's ``dispatch_map``.
+
     """
 
     def __init__(self, val, config):
@@ -107,15 +176,22 @@ class ResourcePredicate(object):
     phash = text
 
     def __call__(self, context, request):
-        # print '--', self.resource_cls
-        # print '--', context.entity
-        return self.resource_cls.is_item(context.entity)
+        # which resource a context is an item of is resolved once per
+        # context, so every view's predicate is a single identity check
+        return context.item_resource is self.resource_cls
 
 
 class _LinkController(type):
 
     def __init__(cls, name, bases, dct):
         super(_LinkController, cls).__init__(name, bases, dct)
+        # every resource has its own children and parents, rather than
+        # sharing the ones of the class it inherits from
+        for attr in ('nested_resources', 'parents'):
+            if attr not in dct:
+                setattr(cls, attr, {})
+        if 'dispatch_table' not in dct:
+            cls.dispatch_table = DispatchTable()
         venusian.attach(cls, cls.link_controller)
 
     @classmethod
@@ -133,9 +209,16 @@ class Resource(object):
     #: all operations on the collection or item of a resource
     controller = None
 
+    #: the resources nested under this one, and the ones it's nested under,
+    #: by name. both are filled in by :func:`nest_under`
     nested_resources = {}
     parents = {}
 
+    #: the resources nested under an item of this one, by name. it's a
+    #: read-only copy of ``nested_resources``, frozen when the application's
+    #: configuration is committed
+    dispatch_table = DispatchTable()
+
     def __init__(self, request, parent=None, name=None, entity=None, **kwargs):
         self.__name__ = name or ''
         self.__parent__ = parent
@@ -160,29 +243,34 @@ class Resource(object):
         return rv
 
     def __getitem__(self, key):
-        # try to get nested resource.
-        # if we get a keyerror, we check the view callables
-        # with the resource as a context
-        entity = None
-        ctx_cls = type(self)
-        try:
-            ctx_cls = self.nested_resources[key]
-        except KeyError:
-            # we couldn't find a nested resource, so now we'll check
-            # to see if there's a way to retrieve the entity based
-            # on its identifier.
-            entity = self.lookup(key)
-            if not entity:
-                # we couldn't find it, so we just re-raise KeyError telling
-                # pyramid to continue with its view callable evaluation
-                raise
-        ctx = self._create_resource_context(ctx_cls, key, entity)
-        return ctx
+        # the root and items can only be followed by a nested resource,
+        # while collections can only be followed by the key of an item.
+        # anything else raises KeyError, to tell pyramid to continue with
+        # its view callable evaluation
+        if self.entity is not None or self.__parent__ is None:
+            return self._create_resource_context(self.dispatch_table[key], key)
+
+        entity = self.lookup_cached(key)
+        if not entity:
+            raise KeyError(key)
+        return self._create_resource_context(type(self), key, entity)
 
     @classmethod
     def lookup(cls, key):
         pass
 
+    def lookup_cached(self, key):
+        """
+        Looks up the entity identified by ``key`` through the request's
+        entity cache, so that it's only loaded once per request, and only
+        once for as long as it's kept in the shared cache.
+        """
+        entities = getattr(self.request, 'maze_entities', None)
+        if entities is None:
+            return self.lookup(key)
+        return entities.get(getattr(self, 'model', type(self)), key,
+                            self.lookup)
+
     @classmethod
     def is_item(cls, entity):
         """
@@ -191,9 +279,30 @@ class Resource(object):
         """
         pass
 
+    @reify
+    def item_resource(self):
+        """
+        The resource this context is an item of, if any: its own, as long as
+        its entity is one of the resource's items. It's worked out once per
+        context.
+        """
+        cls = type(self)
+        return cls if cls.is_item(self.entity) else None
+
     def lookup_parent_entity(self, parent_resource):
         pass
 
+    @classmethod
+    def lookup_parent_entities(cls, resources, parent_resource):
+        """
+        Looks up the parents of many ``resources`` of this class at once.
+        Subclasses that can fetch them in bulk should override it.
+        """
+        return [
+            resource.lookup_parent_entity(parent_resource)
+            for resource in resources
+        ]
+
     def __resource_url__(self, request, info):
         #return urlparse.urljoin(info['physical_path'], info['virtual_path'])
         return ''
@@ -260,6 +369,59 @@ class DymamicResource(Resource):
                 )
                 return parent_object
 
+    @classmethod
+    def lookup_parent_entities(cls, resources, parent_resource):
+        if parent_resource.name == 'Root':
+            return [resource.request.root for resource in resources]
+        related_object = cls.parents.get(parent_resource.name)
+        if not related_object or not related_object.model:
+            return super(DymamicResource, cls).lookup_parent_entities(
+                resources, parent_resource
+            )
+        mapper = inspect(cls.model)
+        rel = mapper.relationships[
+            cls.model.relation_keys()[parent_resource.name.lower()]
+        ]
+        if len(rel.local_remote_pairs) != 1:
+            return super(DymamicResource, cls).lookup_parent_entities(
+                resources, parent_resource
+            )
+        # fetch every parent with a single IN query on the foreign key
+        [(local_column, remote_column)] = rel.local_remote_pairs
+        fk_attr = mapper.get_property_by_column(local_column).key
+        fks = [getattr(resource.entity, fk_attr) for resource in resources]
+        parent_model = related_object.model
+        pk_attr = inspect(parent_model).get_property_by_column(
+            remote_column
+        ).key
+        # parents the request has already looked up aren't fetched again
+        entities = resources[0].request.maze_entities
+        parent_entities = {}
+        for fk in set(fks):
+            parent_entity = entities.peek(parent_model, fk)
+            if parent_entity is not None:
+                parent_entities[fk] = parent_entity
+        missing = set(fks).difference(parent_entities)
+        if missing:
+            for parent_entity in parent_model.query.filter(
+                getattr(parent_model, pk_attr).in_(missing)
+            ):
+                fk = getattr(parent_entity, pk_attr)
+                entities.add(parent_model, fk, parent_entity)
+                parent_entities[fk] = parent_entity
+        parent_objects = []
+        for resource, fk in zip(resources, fks):
+            parent_entity = parent_entities.get(fk)
+            parent_objects.append(
+                parent_entity and related_object(
+                    request=resource.request,
+                    parent=related_object,
+                    name=parent_entity.pk,
+                    entity=parent_entity
+                )
+            )
+        return parent_objects
+
     def __resource_url__(self, request, info):
         return '/'.join([self.__parent__.__name__, self.entity.pk])
 
@@ -287,13 +449,16 @@ class _ViewBuilder(type):
         # 2. __view_defaults__ (@view_defaults decorator on class)
 
         cls_settings = getattr(klass, 'view_config', {})
-        view_kwargs = cls_settings.copy()
+        cls_kwargs = cls_settings.copy()
         view_defaults = getattr(klass, '__view_defaults__', {})
-        view_kwargs.update(view_defaults)
+        cls_kwargs.update(view_defaults)
 
         views = mcs.eligible_views(klass)
         # print 'views: %s for %s' % (views, name)
 
+        # the views are only registered here, and they're all committed in
+        # a single batch along with the rest of the configuration
+        dispatch_map = {}
         for method_name, view in views:
             if not (hasattr(view, 'view_config') or method_name in mcs.ops):
                 continue
@@ -306,16 +471,42 @@ class _ViewBuilder(type):
             if not isinstance(verbs, (tuple, list)):
                 verbs = (verbs,)
 
+            if not hasattr(view, 'view_config'):
+                # plain operations are picked from the controller's dispatch
+                # map, rather than by a predicate of their own
+                for verb in verbs:
+                    dispatch_map[verb, requires_entity] = method_name
+                continue
+
+            view_kwargs = cls_kwargs.copy()
             view_kwargs['request_method'] = verbs
             # 3. impl.view_config (@view_config decorator on method)
             overrides = getattr(view, 'view_config', {})
             view_kwargs.update(overrides)
             view_kwargs.update({'view': klass, 'attr': method_name})
+            # views only apply to their own resource, which also keeps the
+            # views of different controllers from conflicting
+            if klass.resource:
+                view_kwargs.setdefault('context', klass.resource)
             if requires_entity:
                 view_kwargs['resource'] = klass.resource
             # print 'view_kwargs: ', view_kwargs
             scanner.config.add_view(**view_kwargs)
-            scanner.config.commit()
+
+        klass.dispatch_map = dispatch_map
+        if not dispatch_map:
+            return
+        view_kwargs = cls_kwargs.copy()
+        view_kwargs.update({
+            'view': klass,
+            'attr': '_dispatch',
+            'request_method': tuple(sorted(set(
+                verb for verb, _ in dispatch_map
+            ))),
+        })
+        if klass.resource:
+            view_kwargs.setdefault('context', klass.resource)
+        scanner.config.add_view(**view_kwargs)
 
     @classmethod
     def eligible_views(mcs, klass):
@@ -331,10 +522,6 @@ class _ViewBuilder(type):
         return views
 
 
-class NoRouteFound(Exception):
-    pass
-
-
 class Controller(object):
 
     __metaclass__ = _ViewBuilder
@@ -343,36 +530,168 @@ class Controller(object):
     #: the Resource's metaclass during registration
     resource = None
 
+    #: the name of the view for each ``(request method, is item)`` pair,
+    #: built by the :ref:`_ViewBuilder` when the controller is scanned
+    dispatch_map = {}
+
     def __init__(self, context, request):
         self.request = request
         self.context = context
 
-    def route(self, include=None):
+    def _view_name(self):
+        """
+        Looks up the name of the view for the request in :attr:`dispatch_map`.
+        Items fall back to the views that don't require one, as they would
+        to views without a ``resource`` predicate.
+        """
+        method = self.request.method
+        if method == 'HEAD':
+            method = 'GET'
+        dispatch_map = self.dispatch_map
+        if self.context.item_resource is self.resource:
+            name = dispatch_map.get((method, True))
+            if name is not None:
+                return name
+        return dispatch_map.get((method, False))
+
+    def _dispatch(self):
+        name = self._view_name()
+        if name is None:
+            raise HTTPNotFound()
+        return getattr(self, name)()
+
+    def _path_nodes(self, include):
         # - find shortest parth to hit all nodes given the graph
         include = include or []
-        graph = get_current_registry(self.context).graph
-        maze = Maze(graph)
-        node = graph.root.find(self.resource.__name__)
-        include = [graph.root.find(i.__name__) for i in include]
-        path_nodes = maze.route(node, include)
+        registry = get_current_registry(self.context)
+        graph = registry.graph
+        node = graph[self.resource.__name__]
+        include = [graph[i.__name__] for i in include]
         # - if path is not found, throw
-        if not path_nodes:
-            raise NoRouteFound()
+        return registry.routes.route(node, include)
+
+    def _lookup_parent_entities(self, resources, path_node):
+        # assume that each node is nested under some resource that
+        # it has a relation to, so it follows that there exists a
+        # contract that allows us to query the relation
+        registry = self.request.registry
+        # the root is the request's own, so there's nothing to learn
+        learn = (asbool(registry.settings.get('maze.learn_weights'))
+                 and hasattr(registry.graph, 'learn_weight')
+                 and path_node is not registry.graph.root)
+        observed = instrumentation.observers
+        if observed or learn:
+            started = time.time()
+        parent_entities = type(resources[0]).lookup_parent_entities(
+            resources, path_node
+        )
+        if observed or learn:
+            elapsed = time.time() - started
+        if observed:
+            instrumentation.emit(
+                'controller.lookup_parent_entities',
+                elapsed,
+                tags={'parent': path_node.name},
+                resources=len(resources),
+            )
+        if learn:
+            # costs are measured in milliseconds per looked up parent
+            registry.graph.learn_weight(
+                path_node, registry.graph[type(resources[0]).__name__],
+                elapsed * 1000 / len(resources)
+            )
+        return parent_entities
+
+    def resolver(self, lookup=None):
+        """
+        Returns a :ref:`ParentResolver` that looks up parents through
+        ``lookup``, on the application's route pool, if any. ``lookup`` is
+        called from the pool's threads, so it must be thread safe.
+
+        Without a ``lookup``, parents are looked up by the resources' own
+        ``lookup_parent_entities``, on the calling thread: they go through
+        the request's session, which mustn't be used from other threads.
+
+        Parents are shared with every resolver of the request.
+        """
+        if lookup is None:
+            return ParentResolver(
+                self._lookup_parent_entities,
+                cache=self.request.maze_parents,
+                key=self._parent_key,
+            )
+        return ParentResolver(
+            lookup,
+            pool=route_pool(self.request.registry),
+            cache=self.request.maze_parents,
+            key=self._parent_key,
+        )
+
+    @staticmethod
+    def _parent_key(context, path_node):
+        return type(context), context.__name__, path_node
+
+    def _build_urls(self, contexts, path_nodes, resolver=None):
         # - for each node in path, get the resource_url for the node
         #   from the context that satisfy self/include
-        path = [self.context]
-        for path_node in reversed(path_nodes[:-1]):
-            current_entity = path[-1]
-            if not current_entity:
-                break
-            # assume that each node is nested under some resource that
-            # it has a relation to, so it follows that there exists a
-            # contract that allows us to query the relation
-            parent_entity = current_entity.lookup_parent_entity(path_node)
-            path.append(parent_entity)
+        resolver = resolver or self.resolver()
+        return [
+            '/'.join(map(self.request.resource_url, reversed(lineage)))
+            for lineage in resolver.resolve(contexts, path_nodes)
+        ]
 
-        paths = map(self.request.resource_url, reversed(path))
-        return '/'.join(paths)
+    def _contexts(self, entities):
+        return [
+            self.resource(
+                request=self.request,
+                parent=self.resource,
+                name=entity.pk,
+                entity=entity
+            )
+            for entity in entities
+        ]
+
+    def route(self, include=None):
+        return self._build_urls([self.context], self._path_nodes(include))[0]
+
+    def route_many(self, entities, include=None):
+        """
+        Builds the url of each one of ``entities`` of this controller's
+        resource, in order. The route is searched once, and parents are
+        looked up one hop at a time for the whole batch.
+        """
+        return self._build_urls(
+            self._contexts(entities), self._path_nodes(include)
+        )
+
+    def route_async(self, include=None, lookup=None):
+        """
+        Like :meth:`route`, but parents are looked up on the application's
+        route pool, see :meth:`resolver`. Independent urls built this way
+        look up their parents concurrently.
+
+        :return: An ``AsyncResult`` whose ``get()`` returns the url.
+        """
+        return self.route_many_async(None, include, lookup)
+
+    def route_many_async(self, entities, include=None, lookup=None):
+        """
+        Like :meth:`route_many`, but parents are looked up through
+        ``lookup`` on the application's route pool, see :meth:`resolver`.
+
+        :return: An ``AsyncResult`` whose ``get()`` returns the urls.
+        """
+        # the route is searched by the calling thread, since it's cpu bound
+        path_nodes = self._path_nodes(include)
+        resolver = self.resolver(lookup)
+        if entities is None:
+            return resolver.submit(
+                lambda: self._build_urls([self.context], path_nodes,
+                                         resolver)[0]
+            )
+        return resolver.submit(
+            self._build_urls, self._contexts(entities), path_nodes, resolver
+        )
 
 
 # resources start
@@ -382,25 +701,27 @@ class Root(Resource):
     """
 
 
+# the operations the sample doesn't implement aren't found, rather than
+# returning nothing, which pyramid can't convert to a response
 class CorporationsController(Controller):
 
     def options(self):
-        pass
+        raise HTTPNotFound()
 
     def index(self):
-        pass
+        raise HTTPNotFound()
 
     def create(self):
-        pass
+        raise HTTPNotFound()
 
     def show(self):
         return render_to_response('string', 'hallo', request=self.request)
 
     def update(self):
-        pass
+        raise HTTPNotFound()
 
     def delete(self):
-        pass
+        raise HTTPNotFound()
 
 
 # def relationship(*args):
@@ -430,13 +751,13 @@ class Corporations(DymamicResource):
 class DepartmentsController(Controller):
 
     def options(self):
-        pass
+        raise HTTPNotFound()
 
     def index(self):
-        pass
+        raise HTTPNotFound()
 
     def create(self):
-        pass
+        raise HTTPNotFound()
 
     def show(self):
         path = {
@@ -446,10 +767,10 @@ class DepartmentsController(Controller):
         return render_to_response('json', path, request=self.request)
 
     def update(self):
-        pass
+        raise HTTPNotFound()
 
     def delete(self):
-        pass
+        raise HTTPNotFound()
 
 
 @nest_under(Corporations)
@@ -466,10 +787,281 @@ class Employees(DymamicResource):
     pass
 
 
+def _chain_query(chain):
+    """
+    Queries the entities along ``chain``, a list of ``(node, resource, key)``
+    tuples, each one joined to the one before it.
+    """
+    aliases = [saorm.aliased(resource.model) for _, resource, _ in chain]
+    query = Session.query(*aliases)
+    for index, (_, resource, key) in enumerate(chain):
+        alias = aliases[index]
+        mapper = inspect(resource.model)
+        pk_attr = mapper.get_property_by_column(mapper.primary_key[0]).key
+        query = query.filter(getattr(alias, pk_attr) == key)
+        if not index:
+            continue
+        parent_model = chain[index - 1][1].model
+        parent_mapper = inspect(parent_model)
+        rel = mapper.relationships[
+            resource.model.relation_keys()[parent_model.__table__.name]
+        ]
+        for local_column, remote_column in rel.local_remote_pairs:
+            fk_attr = mapper.get_property_by_column(local_column).key
+            parent_pk_attr = parent_mapper.get_property_by_column(
+                remote_column
+            ).key
+            query = query.filter(
+                getattr(alias, fk_attr) ==
+                getattr(aliases[index - 1], parent_pk_attr)
+            )
+    return query
+
+
+def prefetch_chain(request):
+    """
+    Loads every entity along the requested path with a single query, and
+    primes the request's caches with them, so that traversing the path and
+    routing back up it doesn't issue any further queries.
+
+    The path is read as pairs of collection names and keys, as long as they
+    follow the graph and belong to resources that have a model. The query
+    joins each entity to its parent along the relationship between their
+    models, so a path whose entities aren't nested in one another isn't
+    found.
+
+    The last key may just as well be a view name, which only traversal can
+    tell, so when there's no entity by that key the entities before it are
+    loaded instead, and traversal is left to decide.
+
+    :raises HTTPNotFound: If the entities on the path can't be found, other
+                          than the last one.
+    """
+    resources = request.registry.maze_resources
+    segments = traversal_path_info(request.path_info)
+
+    chain = []
+    for child, key in request.registry.maze_dispatcher.match(segments)[0]:
+        resource = resources.get(child.name)
+        if key is None or getattr(resource, 'model', None) is None:
+            break
+        if chain:
+            parent_model = chain[-1][1].model
+            rel_key = resource.model.relation_keys().get(
+                parent_model.__table__.name
+            )
+            if rel_key is None:
+                break
+        chain.append((child, resource, key))
+    if not chain:
+        return
+
+    row = _chain_query(chain).first()
+    if row is None:
+        _, resource, key = chain.pop()
+        if not chain:
+            return
+        if resource.model.query.get(key) is not None:
+            # it's an entity, only it isn't nested in the ones before it
+            raise HTTPNotFound()
+        row = _chain_query(chain).first()
+        if row is None:
+            raise HTTPNotFound()
+    if len(chain) == 1:
+        row = (row,)
+
+    entities = request.maze_entities
+    parents = request.maze_parents
+    for index, ((node, resource, key), entity) in enumerate(zip(chain, row)):
+        entities.add(resource.model, key, entity)
+        if not index:
+            continue
+        parent_node, parent_resource, parent_key = chain[index - 1]
+        parents[resource, key, parent_node] = parent_resource(
+            request=request,
+            parent=parent_resource,
+            name=parent_key,
+            entity=row[index - 1]
+        )
+
+
+class MazeTraverser(ResourceTreeTraverser):
+    """
+    Traverses the resources along a path in a single pass, with the
+    registry's :ref:`Dispatcher`, rather than one ``__getitem__`` at a time.
+    Whatever follows the longest prefix of the path that follows the
+    resource graph is a view name and its subpath, as it is to traversal.
+    Paths that nest a resource where it doesn't belong are rejected before
+    any entity is looked up, so views can't share the names of resources.
+
+    Requests it doesn't handle, e.g. ones with a view selector or under a
+    virtual root, are traversed as usual.
+
+    """
+    def __call__(self, request):
+        if request.matchdict is not None or VH_ROOT_KEY in request.environ:
+            return super(MazeTraverser, self).__call__(request)
+        segments = traversal_path_info(request.path_info)
+        for segment in segments:
+            if segment.startswith(self.VIEW_SELECTOR):
+                return super(MazeTraverser, self).__call__(request)
+
+        chain, rest = request.registry.maze_dispatcher.match(segments)
+        if rest and rest[0] in request.registry.graph:
+            raise HTTPNotFound()
+        context = self.root
+        for index, (node, key) in enumerate(chain):
+            resource = context.dispatch_table[node.name]
+            context = context._create_resource_context(resource, node.name)
+            if key is None:
+                break
+            entity = context.lookup_cached(key)
+            if not entity:
+                # a key that isn't found is a view name, as it is to
+                # traversal
+                return self._result(context, key, segments[2 * index + 2:],
+                                    segments[:2 * index + 1])
+            context = context._create_resource_context(resource, key, entity)
+        if rest:
+            return self._result(context, rest[0], rest[1:],
+                                segments[:len(segments) - len(rest)])
+        return self._result(context, '', (), segments)
+
+    def _result(self, context, view_name, subpath, traversed):
+        return {
+            'context': context,
+            'view_name': view_name,
+            'subpath': subpath,
+            'traversed': traversed,
+            'virtual_root': self.root,
+            'virtual_root_path': (),
+            'root': self.root,
+        }
+
+
+def compile_dispatcher(registry):
+    """
+    Compiles the resource graph into the dispatcher that matches nested urls
+    in a single pass, see :ref:`MazeTraverser`.
+    """
+    registry.maze_dispatcher = Dispatcher(registry.graph)
+
+
 def root_factory(request):
+    if asbool(request.registry.settings.get('maze.prefetch')):
+        prefetch_chain(request)
     return Root(request)
 
 
+def maze_parents(request):
+    """
+    A per-request cache of the parent resources resolved by
+    :meth:`Controller.route`, keyed on the resource's type and name, and the
+    parent's node.
+    """
+    return {}
+
+
+_route_pool_lock = threading.Lock()
+
+
+def route_pool(registry):
+    """
+    Returns the pool that urls are built on concurrently, with the thread
+    safe lookups given to the controllers' async routes, if the
+    ``maze.route_threads`` setting asks for one.
+
+    It's created on first use in every process: the threads of a pool
+    don't survive a fork, so the workers forked from a master that had one
+    must start their own.
+    """
+    threads = int(registry.settings.get('maze.route_threads', 0))
+    if not threads:
+        return None
+    pid = os.getpid()
+    if getattr(registry, 'maze_pool_pid', None) != pid:
+        with _route_pool_lock:
+            if getattr(registry, 'maze_pool_pid', None) != pid:
+                registry.maze_pool = ThreadPool(threads)
+                registry.maze_pool_pid = pid
+    return registry.maze_pool
+
+
+def compile_routes(registry):
+    """
+    Precomputes every route of the resource graph, so that building a url
+    never has to search the graph.
+
+    If the ``maze.snapshot`` setting names a file, the graph and its routes
+    are written to it, for the next application to load instead.
+
+    If ``maze.shared_routes`` is set, the graph and its routes are replaced
+    with a copy published to shared memory, which the workers forked from
+    this process read from instead of holding their own.
+    """
+    if getattr(registry, 'maze_snapshot', None):
+        # a loaded snapshot is memory mapped already
+        return
+    registry.routes = Maze(registry.graph).compile()
+    path = registry.settings.get('maze.snapshot')
+    if path:
+        snapshot.dump(path, registry.graph, registry.routes,
+                      registry.maze_snapshot_key)
+    if asbool(registry.settings.get('maze.shared_routes')):
+        registry.maze_snapshot = snapshot.publish(
+            registry.graph, registry.routes
+        )
+        registry.graph = registry.maze_snapshot.graph
+        registry.routes = registry.maze_snapshot.routes
+
+
+def detach_entity(entity):
+    """
+    Returns a copy of ``entity`` with the values of its columns, which
+    doesn't belong to any session. Requests only ever merge the copy into
+    their own session, so they never share an instance, nor see each
+    other's unflushed changes.
+    """
+    mapper = inspect(entity).mapper
+    copy = mapper.class_()
+    for attr in mapper.column_attrs:
+        setattr(copy, attr.key, getattr(entity, attr.key))
+    saorm.make_transient_to_detached(copy)
+    return copy
+
+
+def maze_entities(request):
+    """
+    The per-request :ref:`EntityCache` resources look up their entities
+    through, backed by the application's shared entity cache if it has one.
+    """
+    return EntityCache(
+        shared=getattr(request.registry, 'entity_cache', None),
+        adopt=lambda entity: Session.merge(entity, load=False),
+        detach=detach_entity,
+    )
+
+
+#: the shared entity caches of the applications, see
+#: :func:`invalidate_entities`
+entity_caches = WeakSet()
+
+
+@event.listens_for(Session, 'after_flush')
+def invalidate_entities(session, flush_context):
+    """
+    Drops the entities changed or deleted by every flush from the shared
+    entity caches.
+    """
+    if not entity_caches:
+        return
+    for entity in session.dirty | session.deleted:
+        mapper = inspect(entity).mapper
+        for pk in inspect(entity).identity or ():
+            for entity_cache in list(entity_caches):
+                entity_cache.delete((mapper.class_, pk))
+
+
 def make_app(default_settings=None, **overrides):
     """
     This function returns a Pyramid WSGI application.
@@ -479,7 +1071,38 @@ def make_app(default_settings=None, **overrides):
     app_settings.update(overrides)
 
     config = Configurator(settings=app_settings)
+    snapshot_path = app_settings.get('maze.snapshot')
+    if snapshot_path:
+        # a snapshot of the graph is only valid for the modules it was
+        # scanned from
+        key = snapshot.modules_key([sys.modules[__name__]])
+        config.registry.maze_snapshot_key = key
+        config.registry.maze_snapshot = snapshot.load(snapshot_path, key)
+        if config.registry.maze_snapshot:
+            config.registry.graph = config.registry.maze_snapshot.graph
+            config.registry.routes = config.registry.maze_snapshot.routes
     config.add_view_predicate('resource', ResourcePredicate)
     config.set_root_factory(root_factory)
+    config.add_request_method(maze_parents, reify=True)
+    config.add_request_method(maze_entities, reify=True)
+    # an optional, process wide cache of looked up entities
+    cache_size = int(app_settings.get('maze.entity_cache.size', 0))
+    if cache_size:
+        ttl = app_settings.get('maze.entity_cache.ttl')
+        entity_cache = LRUCache(cache_size, ttl=float(ttl) if ttl else None)
+        # it's only kept up to date for as long as the application lives
+        entity_caches.add(entity_cache)
+        config.registry.entity_cache = entity_cache
     config.scan()
+    # the graph is complete once scanning is done, so the routes are
+    # compiled when the configuration is committed
+    config.action(('pyramid_maze', 'routes'), compile_routes,
+                  args=(config.registry,))
+    config.action(('pyramid_maze', 'dispatch_tables'), freeze_dispatch_tables,
+                  args=(config.registry,))
+    config.action(('pyramid_maze', 'dispatch'), compile_dispatcher,
+                  args=(config.registry,))
+    # resolve nested urls in one pass, rather than one segment at a time
+    if asbool(app_settings.get('maze.dispatch')):
+        config.add_traverser(MazeTraverser, Root)
     return config.make_wsgi_app()
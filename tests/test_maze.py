@@ -1,10 +1,33 @@
 from __future__ import unicode_literals
 
-from pyramid_maze import Maze, Graph, Node
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
+import json
+import mmap
+import os
+import random
+import socket
+import sys
+import threading
+import time
 
+from pyramid_maze import (
+    Maze, Graph, Node, Lineage, NoRouteFound, CycleError, ParentResolver,
+    Dispatcher, Reachability, traverse, instrumentation, snapshot
+)
+from pyramid_maze.helpers import draw_tree
+
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid.request import Request
+from pyramid.scripting import prepare
+from pyramid.traversal import ResourceTreeTraverser
+from sqlalchemy import event
+from sqlalchemy.inspection import inspect
 from webtest import TestApp
+import mock
 import pytest
 
+from benchmarks.graphs import diamond_lattice, layered_dag
 import simple_app
 
 
@@ -44,6 +67,249 @@ def test_graph(nodes, routes):
     assert g.nodes == set(nodes)
 
 
+def test_graph_lookup(nodes, routes):
+    g = Graph(routes)
+    for node in nodes:
+        assert g[node.name] is node
+        assert g.get(node.name) is node
+    assert 'loans' not in g
+    assert g.get('loans') is None
+    with pytest.raises(KeyError):
+        g['loans']
+
+    # nodes nested deeper than the root's children are indexed as they're
+    # added
+    loans = Node('loans')
+    g['cards'].add_child(loans)
+    assert g['loans'] is loans
+
+
+def test_graph_order(nodes, routes):
+    root, mp, accts, cards = nodes
+    g = Graph(routes)
+    assert g.topological_order == [root, mp, accts, cards]
+    assert g.topological_order is g.topological_order
+    assert g.edges == [
+        (root, mp), (root, accts), (root, cards),
+        (mp, accts), (mp, cards), (accts, cards),
+    ]
+    frozen = g.freeze()
+    assert frozen.topological_order == [frozen[node.name] for node in nodes]
+
+    loans = Node('loans')
+    mp.add_child(loans)
+    loans.add_child(accts)
+    assert g.topological_order == [root, mp, loans, accts, cards]
+
+
+def test_graph_cycles(nodes, routes):
+    root, mp, accts, cards = nodes
+    g = Graph(routes)
+    version = g.version
+    with pytest.raises(CycleError) as e:
+        cards.add_child(mp)
+    assert e.value.cycle == [cards, mp, cards]
+    assert 'Cycle: cards -> mp -> cards' in str(e.value)
+    # the edge isn't added, so the graph is left as it was
+    assert cards.children == []
+    assert g.version == version
+    assert Maze(g).route(cards) == [root, cards]
+
+    with pytest.raises(CycleError) as e:
+        accts.add_child(accts)
+    assert e.value.cycle == [accts, accts]
+
+    # and so are edges that bring along nodes that are already cyclic
+    x, y = Node('x'), Node('y')
+    x.add_child(y)
+    y.add_child(x)
+    with pytest.raises(CycleError) as e:
+        accts.add_child(x)
+    assert e.value.cycle == [x, y, x]
+    assert accts.children == [cards]
+    assert 'x' not in g and not x.graphs
+    assert g.version == version
+    assert g.topological_order[-1] is cards
+
+    # cycles that existed before the graph was built are found, too
+    loop, again = Node('loop'), Node('again')
+    cards.children.append(loop)
+    loop.add_child(again)
+    again.add_child(loop)
+    with pytest.raises(CycleError) as e:
+        Graph(routes)
+    assert e.value.cycle == [loop, again, loop]
+    # and the rejected graph lets go of the nodes
+    assert all(len(node.graphs) == 1 for node in (root, mp, accts, cards))
+    assert not loop.graphs and not again.graphs
+
+
+def test_graphs_share_nodes(nodes, routes):
+    root, mp, accts, cards = nodes
+    first, second = Graph(routes), Graph(routes)
+    assert set(root.graphs) == set([first, second])
+    maze = Maze(first)
+    assert maze.route(cards) == [root, cards]
+
+    leaf = Node('leaf')
+    accts.add_child(leaf)
+    # both graphs are told about the edge
+    assert first.version == second.version == 1
+    assert first['leaf'] is second['leaf'] is leaf
+    assert maze.route(leaf) == [root, accts, leaf]
+    assert Maze(second).route(leaf) == [root, accts, leaf]
+
+
+def test_draw(nodes, routes):
+    root, mp, accts, cards = nodes
+    g = Graph(routes)
+    # shared nodes are only drawn in full once
+    assert draw_tree(routes) == (
+        'root\n'
+        '  +--mp\n'
+        '  |  +--accts\n'
+        '  |  |  +--cards\n'
+        '  |  +--cards\n'
+        '  +--accts (see above)\n'
+        '  +--cards\n'
+    )
+    assert draw_tree(routes, max_depth=1) == (
+        'root\n'
+        '  +--mp ...\n'
+        '  +--accts ...\n'
+        '  +--cards\n'
+    )
+
+    # a node cut off by max_depth is drawn in full where it's shallower
+    top, a, x = Node('top'), Node('a'), Node('x')
+    top.add_child(a)
+    a.add_child(x)
+    x.add_child(Node('y'))
+    top.add_child(x)
+    assert draw_tree(top, max_depth=2) == (
+        'top\n'
+        '  +--a\n'
+        '  |  +--x ...\n'
+        '  +--x\n'
+        '     +--y\n'
+    )
+
+    sink = StringIO()
+    g.draw(sink, max_depth=0)
+    assert sink.getvalue() == '\nroot ...\n\n'
+
+    sink = StringIO()
+    g.write_dot(sink)
+    assert sink.getvalue().splitlines() == [
+        'digraph "maze" {',
+        '  "root";',
+        '  "root" -> "mp";',
+        '  "root" -> "accts";',
+        '  "root" -> "cards";',
+        '  "mp";',
+        '  "mp" -> "accts";',
+        '  "mp" -> "cards";',
+        '  "accts";',
+        '  "accts" -> "cards";',
+        '  "cards";',
+        '}',
+    ]
+
+    sink = StringIO()
+    g.freeze().write_json(sink)
+    assert json.loads(sink.getvalue()) == {
+        'root': 'root',
+        'adjacency': {
+            'root': ['mp', 'accts', 'cards'],
+            'mp': ['accts', 'cards'],
+            'accts': ['cards'],
+            'cards': [],
+        },
+    }
+
+
+def test_reachability(nodes, routes):
+    root, mp, accts, cards = nodes
+    g = Graph(routes)
+    reachability = g.reachability
+    assert g.reachability is reachability
+    assert reachability.reaches(mp, cards)
+    assert not reachability.reaches(cards, mp)
+    assert reachability.distance(root, cards) == 1
+    assert reachability.distance(mp, root) is None
+    assert reachability.ancestors_of(accts) == set([root, mp, accts])
+    assert reachability.descendants_of(accts) == set([accts, cards])
+    assert reachability.depths(root) == {root: 0, mp: 1, accts: 1, cards: 1}
+
+    assert reachability.feasible(root, cards, [mp, accts])
+    assert not reachability.feasible(root, accts, [cards])
+    assert not reachability.feasible(root, cards, [cards])
+
+    loans = Node('loans')
+    accts.add_child(loans)
+    assert g.reachability is reachability
+    assert reachability.reaches(root, loans)
+    assert not reachability.feasible(root, loans, [cards])
+
+
+def test_frozen_graph(nodes, routes):
+    frozen = Graph(routes).freeze()
+    assert len(frozen) == 4
+    assert frozen.root.name == 'root'
+    assert list(frozen.offsets) == [0, 3, 5, 6, 6]
+    assert [c.name for c in frozen['mp'].children] == ['accts', 'cards']
+    assert set(n.name for n in frozen.nodes) == set(n.name for n in nodes)
+
+    r = Maze(frozen)
+    path = r.route(frozen['cards'], include=[frozen['accts']])
+    assert [node.name for node in path] == ['root', 'accts', 'cards']
+
+    with pytest.raises(TypeError):
+        frozen['cards'].add_child(frozen['mp'])
+
+
+def test_snapshot(nodes, routes):
+    root, mp, accts, cards = nodes
+    g = Graph(routes)
+    table = Maze(g).compile(includes=[[mp], [cards]])
+    loaded = snapshot.Snapshot.from_buffer(
+        snapshot.dumps(g, table, b'k' * 20), b'k' * 20
+    )
+    assert loaded.graph.names == ['root', 'mp', 'accts', 'cards']
+    assert list(loaded.graph.targets) == list(g.freeze().targets)
+    assert len(loaded.routes) == len(table) == 12
+
+    frozen = loaded.graph
+    path = loaded.routes.route(frozen['cards'], include=[frozen['mp']])
+    assert [node.name for node in path] == ['root', 'mp', 'cards']
+    with pytest.raises(NoRouteFound):
+        loaded.routes.route(frozen['accts'], include=[frozen['cards']])
+    # routes that weren't snapshotted are still solved
+    path = loaded.routes.route(frozen['cards'], include=[frozen['accts']])
+    assert [node.name for node in path] == ['root', 'accts', 'cards']
+
+    # snapshots taken with a different key are ignored
+    assert snapshot.Snapshot.from_buffer(
+        snapshot.dumps(g, table, b'k' * 20), b'x' * 20
+    ) is None
+
+
+def test_traverse_lineage(routes):
+    cards = routes.find('cards')
+    paths = []
+
+    def on_visit(path):
+        if path[-1] is cards:
+            paths.append('/'.join(node.name for node in path))
+        return Node.decorate_leaves_with_lineage(path)
+
+    traverse(Lineage(routes), on_visit, validate=False)
+    assert paths == [
+        'root/cards', 'root/mp/cards', 'root/accts/cards',
+        'root/mp/accts/cards',
+    ]
+
+
 def test_maze(routes):
     routes.draw()
     cards = routes.find('cards')
@@ -66,6 +332,414 @@ def test_maze(routes):
     )
 
 
+def test_route_table(routes):
+    cards = routes.find('cards')
+    mp = routes.find('mp')
+    table = Maze(Graph(routes)).compile(includes=[[mp]])
+    assert len(table) == 8
+    assert table.route(cards) == (routes, cards)
+    assert table.route(cards, include=[mp]) == (routes, mp, cards)
+    # combinations that weren't declared are solved on first use
+    accts = routes.find('accts')
+    assert table.route(cards, include=[accts, mp]) == (
+        routes, mp, accts, cards
+    )
+    assert len(table) == 9
+
+
+def test_maze_cache(routes):
+    cards = routes.find('cards')
+    mp = routes.find('mp')
+    g = Graph(routes)
+    r = Maze(g, cache_size=2)
+    assert r.route(cards) == [routes, cards]
+    assert r.route(cards) == [routes, cards]
+    r.route(cards, include=[mp])
+    r.route(mp)
+    assert r.cache.stats == {
+        'hits': 1, 'misses': 3, 'evictions': 1, 'size': 2,
+    }
+
+    # adding an edge only drops the memoized routes to nodes under it
+    shortcut = Node('shortcut')
+    mp.add_child(shortcut)
+    assert g.version == 1
+    assert shortcut in g.nodes
+    shortcut.add_child(cards)
+    assert g.version == 2
+    assert g.changes == [(mp, shortcut), (shortcut, cards)]
+    assert g.changed_since(0) == set([shortcut, cards])
+    assert g.changed_since(1) == set([cards])
+    assert r.route(cards, include=[shortcut]) == [
+        routes, mp, shortcut, cards
+    ]
+    assert len(r.cache) == 2
+    assert (mp, frozenset()) in r.cache
+    assert (cards, frozenset([mp])) not in r.cache
+
+
+def test_incremental_updates(nodes, routes):
+    root, mp, accts, cards = nodes
+    g = Graph(routes)
+    table = Maze(g).compile(includes=[[mp]])
+    reachability = g.reachability
+    order = g.topological_order
+
+    # edges between nodes that are already ordered keep the order
+    loans, fees = Node('loans'), Node('fees')
+    root.add_child(loans)
+    assert g.topological_order is not order
+    order = g.topological_order
+    loans.add_child(cards)
+    assert g.topological_order is order
+
+    # the matrices are updated in place, to what they'd be computed as
+    loans.add_child(fees)
+    fees.add_child(accts)
+    assert g.reachability is reachability
+    fresh = Reachability(g.topological_order)
+    for node in g.nodes:
+        assert reachability.descendants_of(node) == fresh.descendants_of(node)
+        assert reachability.ancestors_of(node) == fresh.ancestors_of(node)
+        for other in g.nodes:
+            assert (reachability.distance(node, other) ==
+                    fresh.distance(node, other))
+
+    # nodes added later are precomputed like the rest
+    assert table.route(fees) == (root, loans, fees)
+    assert table.route(accts) == (root, accts)
+    assert table.route(cards, include=[mp]) == (root, mp, cards)
+    with pytest.raises(NoRouteFound):
+        table.route(fees, include=[mp])
+    assert len(table) == 2 * len(g.nodes)
+    assert dict(table.items())[accts, frozenset([mp])] == (root, mp, accts)
+
+
+def assert_routes_are_fresh(g, table):
+    fresh = Maze(g)
+    for (node, include), path in table.items():
+        try:
+            expected = tuple(fresh.route(node, include))
+        except NoRouteFound:
+            expected = None
+        assert path == expected, (node, include)
+
+
+def race(readers, write):
+    """
+    Calls every one of ``readers`` in a loop of its own thread while
+    ``write`` runs, switching threads as often as possible.
+    """
+    done = threading.Event()
+
+    def read(reader):
+        while not done.is_set():
+            reader()
+
+    threads = [threading.Thread(target=read, args=(reader,))
+               for reader in readers]
+    interval = sys.getcheckinterval()
+    sys.setcheckinterval(1)
+    try:
+        for thread in threads:
+            thread.start()
+        write()
+    finally:
+        done.set()
+        for thread in threads:
+            thread.join()
+        sys.setcheckinterval(interval)
+
+
+@pytest.mark.parametrize('seed', xrange(5))
+def test_concurrent_late_edges(seed):
+    g, layers = layered_dag(width=6, depth=6, fan_in=2, seed=seed)
+    table = Maze(g).compile(includes=[[layers[1][0]]])
+    nodes = list(g.topological_order)
+
+    def reader(seed):
+        rng = random.Random(seed)
+        return lambda: table.route(rng.choice(nodes))
+
+    def write():
+        # shortcuts, and nodes registered late, under every layer
+        for layer in layers[1:]:
+            for node in layer:
+                g.root.add_child(node)
+                node.add_child(Node('late_%s' % node.name))
+                time.sleep(0)
+
+    race([reader(index) for index in xrange(6)], write)
+    assert_routes_are_fresh(g, table)
+
+
+@pytest.mark.parametrize('seed', xrange(5))
+def test_concurrent_weights(seed):
+    g, layers = layered_dag(width=6, depth=6, fan_in=3, seed=seed)
+    table = Maze(g).compile(includes=[[layers[1][0]]])
+    nodes = list(g.topological_order)
+    edges = g.edges
+
+    def reader(seed):
+        rng = random.Random(seed)
+        return lambda: table.route(rng.choice(nodes))
+
+    def write():
+        rng = random.Random(seed)
+        for _ in xrange(1000):
+            parent, child = rng.choice(edges)
+            g.set_weight(parent, child, rng.uniform(0.1, 5))
+            time.sleep(0)
+
+    race([reader(index) for index in xrange(6)], write)
+    assert_routes_are_fresh(g, table)
+
+
+def test_weighted_routes(nodes, routes):
+    root, mp, accts, cards = nodes
+    g = Graph(routes)
+    r = Maze(g)
+    assert r.route(cards) == [root, cards]
+
+    # the cheapest path is taken, rather than the one with the fewest hops
+    g.set_weight(root, cards, 3)
+    assert r.route(cards) == [root, mp, cards]
+    # and ties on cost are broken on hops
+    g.set_weight(root, cards, 2)
+    assert r.route(cards) == [root, cards]
+
+    loans = Node('loans')
+    mp.add_child(loans, weight=0.5)
+    loans.add_child(cards, weight=0.25)
+    assert r.route(cards) == [root, mp, loans, cards]
+    assert r.route(cards, include=[accts]) == [root, accts, cards]
+    g.set_weight(root, accts, 5)
+    assert r.route(cards, include=[accts]) == [root, mp, accts, cards]
+
+    with pytest.raises(ValueError):
+        g.set_weight(cards, root, 1)
+    with pytest.raises(ValueError):
+        mp.add_child(Node('negative'), weight=-1)
+
+    # weights survive freezing and snapshots
+    frozen = g.freeze()
+    assert frozen['mp'].weights == {
+        frozen['accts']: 1, frozen['cards']: 1, frozen['loans']: 0.5,
+    }
+    loaded = snapshot.Snapshot.from_buffer(
+        snapshot.dumps(g, Maze(g).compile(), b'k' * 20), b'k' * 20
+    )
+    assert list(loaded.graph.weights) == list(frozen.weights)
+    path = Maze(loaded.graph).route(loaded.graph['cards'])
+    assert [node.name for node in path] == ['root', 'mp', 'loans', 'cards']
+
+
+def test_learned_weights(nodes, routes):
+    root, mp, accts, cards = nodes
+    g = Graph(routes)
+    table = Maze(g).compile()
+    assert table.route(cards) == (root, cards)
+
+    # costs are learned relative to one another, whatever their unit, so
+    # an edge that costs as much as the others keeps weighing one
+    assert not g.learn_weight(root, cards, 0.002)
+    assert not g.learn_weight(root, mp, 0.0021)
+    assert g.version == 0
+    for _ in xrange(10):
+        g.learn_weight(root, mp, 0.001)
+        g.learn_weight(mp, cards, 0.001)
+        g.learn_weight(root, cards, 0.004)
+    # edges that were never measured keep weighing one
+    assert mp.weights[accts] == 1
+    assert 1.5 < root.weights[cards] <= 2
+    assert 0.4 < root.weights[mp] < 1
+    assert table.route(cards) == (root, mp, cards)
+
+
+def test_changes_are_compacted(nodes, routes):
+    root, mp, accts, cards = nodes
+    g = Graph(routes)
+    g.max_changes = 4
+    maze = Maze(g)
+    assert maze.route(cards) == [root, cards]
+    lagging = Maze(g)
+    assert lagging.route(accts) == [root, accts]
+
+    for weight in (5, 4, 3, 2, 1, 3):
+        g.set_weight(root, cards, weight)
+        assert maze.route(cards) == [root, mp, cards] if weight > 2 else [
+            root, cards
+        ]
+    assert g.version == 6
+    assert len(g.changes) <= g.max_changes
+    assert g.changes_start == g.version - len(g.changes)
+    # changes that were dropped can't be told apart, so everything is
+    # taken to have changed
+    assert g.changed_since(0) == g.nodes
+    assert g.changed_since(g.version - 1) == set([cards])
+    g.set_weight(root, accts, 3)
+    assert lagging.route(accts) == [root, mp, accts]
+
+
+def test_app_learned_weights():
+    app = TestApp(simple_app.make_app(**{'maze.learn_weights': 'true'}))
+    assert app.get('/Corporations/CR123/Departments/DP456').json == {
+        'uri': '/Departments/DP456',
+        'under_corporations_uri': '/Corporations/CR123/Departments/DP456'
+    }
+    graph = app.app.registry.graph
+    # parents under the root aren't looked up, so they aren't learned
+    assert set(
+        (parent.name, child.name) for parent, child in graph._costs
+    ) == set([('Corporations', 'Departments')])
+    for parent in graph.nodes:
+        assert all(weight == 1 for weight in parent.weights.values())
+
+
+def test_maze_unsatisfiable_include(routes):
+    cards = routes.find('cards')
+    accts = routes.find('accts')
+    r = Maze(Graph(routes))
+    # ``cards`` has no children, so it can never be visited on the way
+    # to ``accts``
+    with pytest.raises(NoRouteFound) as exc_info:
+        r.route(accts, include=[cards])
+    assert exc_info.value.node is accts
+    assert exc_info.value.include == set([cards])
+
+    table = r.compile(includes=[[cards]])
+    with pytest.raises(NoRouteFound):
+        table.route(accts, include=[cards])
+
+
+def test_maze_unknown_nodes(routes):
+    accts = routes.find('accts')
+    stray = Node('stray')
+    r = Maze(Graph(routes))
+    with pytest.raises(NoRouteFound):
+        r.route(accts, include=[stray])
+    with pytest.raises(NoRouteFound):
+        r.route(stray)
+
+    # one include that can't be routed doesn't keep the others from
+    # being compiled
+    table = r.compile(includes=[[stray], [routes.find('mp')]])
+    assert table.route(routes.find('cards'), include=[routes.find('mp')])
+    with pytest.raises(NoRouteFound):
+        table.route(accts, include=[stray])
+
+
+def test_maze_prunes_dead_ends():
+    expanded = []
+
+    class RecordingNode(Node):
+        @property
+        def children(self):
+            expanded.append(self.name)
+            return self._children
+
+        @children.setter
+        def children(self, children):
+            self._children = children
+
+    # a wide fan of dead ends hanging off the root shouldn't be explored
+    root, via, target = (RecordingNode(name)
+                         for name in ('root', 'via', 'target'))
+    for index in xrange(50):
+        dead_end = RecordingNode('dead%d' % index)
+        root.add_child(dead_end)
+        dead_end.add_child(RecordingNode('deeper%d' % index))
+    root.add_child(via)
+    via.add_child(target)
+    g = Graph(root)
+    g.reachability
+
+    del expanded[:]
+    assert Maze(g).route(target, include=[via]) == [root, via, target]
+    assert expanded == ['root', 'via']
+
+
+@pytest.yield_fixture()
+def aggregator():
+    aggregator = instrumentation.subscribe(instrumentation.Aggregator())
+    yield aggregator
+    instrumentation.unsubscribe(aggregator)
+
+
+def test_instrumentation(routes, aggregator):
+    g = Graph(routes)
+    g.nodes
+    r = Maze(g)
+    r.route(routes.find('cards'), include=[routes.find('mp')])
+    r.route(routes.find('cards'), include=[routes.find('mp')])
+
+    events = aggregator.snapshot()
+    assert events['traverse']['count'] == 1
+    assert events['traverse']['counters'] == {'visits': 7}
+    assert events['maze.route']['count'] == 2
+    assert events['maze.route']['counters'] == {
+        'cache_hit': 1, 'cache_miss': 1, 'considered': 4, 'expanded': 4,
+    }
+    assert events['maze.route']['max_time'] > 0
+
+    aggregator.reset()
+    assert aggregator.snapshot() == {}
+
+
+def test_route_table_instrumentation(routes, aggregator):
+    g = Graph(routes)
+    table = Maze(g).compile()
+    loaded = snapshot.Snapshot.from_buffer(
+        snapshot.dumps(g, table, b'k' * 20), b'k' * 20
+    )
+    for route_table in (table, loaded.routes):
+        graph = route_table.maze.graph
+        aggregator.reset()
+        route_table.route(graph['cards'])
+        # combined with an include that wasn't compiled, then remembered
+        route_table.route(graph['cards'], include=[graph['mp']])
+        route_table.route(graph['cards'], include=[graph['mp']])
+        events = aggregator.snapshot()
+        assert events['route_table.route']['count'] == 3
+        assert events['route_table.route']['counters'] == {
+            'cache_hit': 2, 'cache_miss': 1,
+        }
+
+
+def test_statsd_observer():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(1)
+    observer = instrumentation.StatsdObserver(*server.getsockname())
+    try:
+        observer('controller.lookup_parent_entities', 0.0015,
+                 {'parent': 'Corporations'}, {'resources': 3})
+        assert server.recv(1024).splitlines() == [
+            'pyramid_maze.controller.lookup_parent_entities.Corporations'
+            ':1.500|ms',
+            'pyramid_maze.controller.lookup_parent_entities.Corporations'
+            '.resources:3|c',
+        ]
+    finally:
+        observer.close()
+        server.close()
+
+
+def test_maze_diamond_lattice():
+    # 40 stacked diamonds: 2^40 distinct root -> sink paths
+    g, sink = diamond_lattice(40)
+    r = Maze(g)
+    assert len(r.route(sink)) == 81
+    assert r.route(sink)[1].name == 'l1'
+
+
+def test_graph_nodes_diamond_lattice(aggregator):
+    g, _ = diamond_lattice(40)
+    assert len(g.nodes) == 121
+    # every edge is followed once, rather than once for every path
+    assert aggregator.snapshot()['traverse']['counters'] == {'visits': 161}
+
+
 @pytest.fixture(scope='module', autouse=True)
 def create_models():
     simple_app.Base.metadata.drop_all()
@@ -95,6 +769,602 @@ def test_maze_with_resources(app):
     }
 
 
+@pytest.mark.parametrize('path', [
+    '/Corporations',
+    '/Corporations/CR123/Departments',
+])
+def test_collections(app, path):
+    app.get(path, status=404)
+    app.options(path, status=404)
+
+
+def test_route_resolves_each_parent_once_per_request(app):
+    def show(self):
+        uris = [self.route(include=[simple_app.Corporations])
+                for _ in xrange(3)]
+        return simple_app.render_to_response('json', uris,
+                                             request=self.request)
+
+    hops = []
+    lookup = simple_app.DymamicResource.lookup_parent_entities.__func__
+
+    def lookup_parent_entities(cls, resources, parent_resource):
+        hops.append(parent_resource.name)
+        return lookup(cls, resources, parent_resource)
+
+    with mock.patch.object(simple_app.DepartmentsController, 'show', show):
+        with mock.patch.object(simple_app.DymamicResource,
+                               'lookup_parent_entities',
+                               classmethod(lookup_parent_entities)):
+            res = app.get('/Corporations/CR123/Departments/DP456')
+    assert res.json == ['/Corporations/CR123/Departments/DP456'] * 3
+    assert hops == ['Corporations', 'Root']
+
+
+def test_route_many(app):
+    acme = simple_app.CorporationsModel.query.get('CR123')
+    initech = simple_app.CorporationsModel(pk='CR789', name='initech')
+    departments = [
+        simple_app.DepartmentsModel(pk='DP%d' % i, name='dept',
+                                    corporation=corporation)
+        for i, corporation in enumerate([initech, acme, initech])
+    ]
+    simple_app.ses.add_all(departments)
+    simple_app.ses.flush()
+    statements = []
+
+    def count(*args):
+        statements.append(args)
+
+    def show(self):
+        event.listen(simple_app.engine, 'before_cursor_execute', count)
+        try:
+            uris = self.route_many(departments,
+                                   include=[simple_app.Corporations])
+        finally:
+            event.remove(simple_app.engine, 'before_cursor_execute', count)
+        return simple_app.render_to_response('json', uris,
+                                             request=self.request)
+
+    try:
+        with mock.patch.object(simple_app.DepartmentsController, 'show',
+                               show):
+            res = app.get('/Corporations/CR123/Departments/DP456')
+    finally:
+        simple_app.ses.rollback()
+    assert res.json == [
+        '/Corporations/CR789/Departments/DP0',
+        '/Corporations/CR123/Departments/DP1',
+        '/Corporations/CR789/Departments/DP2',
+    ]
+    # one query for every corporation
+    assert len(statements) == 1
+
+
+@pytest.yield_fixture()
+def statements():
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(simple_app.engine, 'before_cursor_execute', count)
+    yield statements
+    event.remove(simple_app.engine, 'before_cursor_execute', count)
+
+
+def test_entity_cache(statements):
+    app = TestApp(simple_app.make_app(**{'maze.entity_cache.size': '10'}))
+    expected = {
+        'uri': '/Departments/DP456',
+        'under_corporations_uri': '/Corporations/CR123/Departments/DP456'
+    }
+
+    simple_app.ses.expunge_all()
+    assert app.get('/Corporations/CR123/Departments/DP456').json == expected
+    # the corporation looked up while traversing is reused for its url
+    assert len(statements) == 2
+
+    del statements[:]
+    simple_app.ses.expunge_all()
+    assert app.get('/Corporations/CR123/Departments/DP456').json == expected
+    assert statements == []
+    assert app.app.registry.entity_cache.stats['hits'] == 2
+
+    # flushing changes to an entity drops it from the shared cache
+    simple_app.DepartmentsModel.query.get('DP456').name = 'marketing'
+    simple_app.ses.flush()
+    simple_app.ses.rollback()
+    assert len(app.app.registry.entity_cache) == 1
+
+
+def test_entity_cache_shares_detached_copies():
+    app = TestApp(simple_app.make_app(**{'maze.entity_cache.size': '10'}))
+    path = '/Corporations/CR123/Departments/DP456'
+
+    def show(self):
+        return simple_app.render_to_response(
+            'json', self.context.entity.name, request=self.request
+        )
+
+    responses = []
+
+    def get():
+        try:
+            responses.append(app.get(path).json)
+        finally:
+            simple_app.Session.remove()
+
+    simple_app.ses.expunge_all()
+    with mock.patch.object(simple_app.DepartmentsController, 'show', show):
+        assert app.get(path).json == 'sales'
+        department = simple_app.DepartmentsModel.query.get('DP456')
+        cached = app.app.registry.entity_cache.get(
+            (simple_app.DepartmentsModel, 'DP456')
+        )
+        assert cached is not department
+        assert inspect(cached).detached
+
+        # the entity is dirty in this thread's session, which another
+        # request mustn't see, nor trip over
+        department.name = 'marketing'
+        try:
+            thread = threading.Thread(target=get)
+            thread.start()
+            thread.join()
+        finally:
+            simple_app.ses.rollback()
+    assert responses == ['sales']
+    assert cached.name == 'sales'
+
+
+def test_prefetch_chain(statements):
+    app = TestApp(simple_app.make_app(**{'maze.prefetch': 'true'}))
+
+    simple_app.ses.expunge_all()
+    res = app.get('/Corporations/CR123/Departments/DP456')
+    assert res.json == {
+        'uri': '/Departments/DP456',
+        'under_corporations_uri': '/Corporations/CR123/Departments/DP456'
+    }
+    # the corporation and its department are loaded together
+    assert len(statements) == 1
+    assert ('departments_1.corporation_pk = corporations_1.pk'
+            in statements[0])
+
+    # the department doesn't belong to that corporation
+    nested = simple_app.CorporationsModel(pk='CR000', name='nested')
+    simple_app.ses.add(nested)
+    simple_app.ses.flush()
+    try:
+        app.get('/Corporations/CR000/Departments/DP456', status=404)
+    finally:
+        simple_app.ses.rollback()
+
+
+@pytest.mark.parametrize('path, context, view_name', [
+    ('/Corporations/CR123/Departments/edit', simple_app.Departments, 'edit'),
+    ('/Corporations/edit', simple_app.Corporations, 'edit'),
+])
+def test_prefetch_chain_view_name(path, context, view_name):
+    registry = simple_app.make_app(**{'maze.prefetch': 'true'}).registry
+
+    def prefetch(path):
+        env = prepare(request=Request.blank(path), registry=registry)
+        try:
+            return env['request'], simple_app.root_factory(env['request'])
+        finally:
+            env['closer']()
+
+    try:
+        # the last key isn't an entity's, so it's left for traversal to tell
+        request, root = prefetch(path)
+        result = ResourceTreeTraverser(root)(request)
+        assert type(result['context']) is context
+        assert result['view_name'] == view_name
+
+        # the entities before it must be found, though
+        with pytest.raises(HTTPNotFound):
+            prefetch('/Corporations/CR000/Departments/edit')
+    finally:
+        simple_app.ses.rollback()
+
+
+def test_dispatch_tables(app, statements):
+    assert simple_app.Root.dispatch_table == {
+        'Corporations': simple_app.Corporations,
+        'Departments': simple_app.Departments,
+        'Employees': simple_app.Employees,
+    }
+    assert simple_app.Corporations.dispatch_table == {
+        'Departments': simple_app.Departments,
+    }
+    assert simple_app.Departments.parents == {
+        'Root': simple_app.Root,
+        'Corporations': simple_app.Corporations,
+    }
+    assert simple_app.Employees.dispatch_table == {}
+    with pytest.raises(TypeError):
+        simple_app.Root.dispatch_table['Employees'] = simple_app.Employees
+
+    # employees aren't nested under corporations, and items aren't nested
+    # under items, so neither is looked up
+    app.get('/Corporations/CR123/Employees', status=404)
+    app.get('/Corporations/CR123/CR123', status=404)
+    assert statements
+    assert all('FROM corporations' in statement for statement in statements)
+
+
+def test_views_are_committed_in_a_single_batch():
+    commit = simple_app.Configurator.commit
+    with mock.patch.object(simple_app.Configurator, 'commit', autospec=True,
+                           side_effect=commit) as commits:
+        simple_app.make_app()
+    # the defaults are committed when the configurator is set up, and
+    # everything else when the app is made
+    assert commits.call_count == 2
+
+
+def test_dispatch_map(app):
+    assert simple_app.CorporationsController.dispatch_map == {
+        ('OPTIONS', False): 'options',
+        ('GET', False): 'index',
+        ('POST', False): 'create',
+        ('GET', True): 'show',
+        ('PUT', True): 'update',
+        ('PATCH', True): 'update',
+        ('DELETE', True): 'delete',
+    }
+    predicate = simple_app.ResourcePredicate.__call__.__func__
+    calls = []
+
+    def call(self, context, request):
+        calls.append(context)
+        return predicate(self, context, request)
+
+    # items and collections are told apart by a lookup, not by predicates
+    with mock.patch.object(simple_app.ResourcePredicate, '__call__', call):
+        assert app.get('/Corporations/CR123').body == 'hallo'
+        app.head('/Corporations/CR123', status=200)
+        app.get('/Corporations', status=404)
+    assert calls == []
+
+
+def test_item_resource(app):
+    def show(self):
+        return simple_app.render_to_response(
+            'json', [self.context.item_resource.__name__,
+                     self.context.__parent__.item_resource],
+            request=self.request
+        )
+
+    with mock.patch.object(simple_app.DepartmentsController, 'show', show):
+        res = app.get('/Corporations/CR123/Departments/DP456')
+    assert res.json == ['Departments', None]
+
+    # resources that share a model each have their own items
+    class Partners(simple_app.DymamicResource):
+        model = simple_app.CorporationsModel
+
+    corporation = simple_app.CorporationsModel.query.get('CR123')
+    for resource in (simple_app.Corporations, Partners):
+        context = resource(request=None, name='CR123', entity=corporation)
+        assert context.item_resource is resource
+    assert Partners(request=None).item_resource is None
+
+
+def test_app_snapshot(tmpdir):
+    path = str(tmpdir.join('maze.snapshot'))
+    expected = {
+        'uri': '/Departments/DP456',
+        'under_corporations_uri': '/Corporations/CR123/Departments/DP456'
+    }
+    app = TestApp(simple_app.make_app(**{'maze.snapshot': path}))
+    assert app.app.registry.maze_snapshot is None
+    assert app.get('/Corporations/CR123/Departments/DP456').json == expected
+    assert tmpdir.join('maze.snapshot').check()
+
+    app = TestApp(simple_app.make_app(**{'maze.snapshot': path}))
+    assert app.app.registry.maze_snapshot
+    assert app.app.registry.graph is app.app.registry.maze_snapshot.graph
+    assert len(app.app.registry.graph) == 4
+    assert app.get('/Corporations/CR123/Departments/DP456').json == expected
+
+
+def test_app_shared_routes():
+    app = TestApp(simple_app.make_app(**{'maze.shared_routes': 'true'}))
+    registry = app.app.registry
+    assert isinstance(registry.maze_snapshot.buf, mmap.mmap)
+    assert registry.graph is registry.maze_snapshot.graph
+    assert app.get('/Corporations/CR123/Departments/DP456').json == {
+        'uri': '/Departments/DP456',
+        'under_corporations_uri': '/Corporations/CR123/Departments/DP456'
+    }
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def test_shared_routes_fork(nodes, routes):
+    root, mp, accts, cards = nodes
+    g = Graph(routes)
+    shared = snapshot.publish(g, Maze(g).compile(includes=[[mp]]))
+    frozen = shared.graph
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if not pid:
+        try:
+            path = shared.routes.route(frozen['cards'], [frozen['mp']])
+            os.write(write, ' '.join(node.name for node in path))
+        finally:
+            os._exit(0)
+    os.close(write)
+    os.waitpid(pid, 0)
+    assert os.read(read, 1024) == b'root mp cards'
+    os.close(read)
+
+
+class LocalParents(object):
+    """
+    A stand-in data source that looks up parents from a dict, taking
+    ``latency`` seconds per lookup like a remote one would.
+    """
+
+    def __init__(self, parents, latency=0):
+        self.parents = parents
+        self.latency = latency
+        self.calls = []
+
+    def __call__(self, entities, node):
+        self.calls.append((list(entities), node.name))
+        time.sleep(self.latency)
+        return [self.parents.get((entity, node.name)) for entity in entities]
+
+
+def test_parent_resolver(nodes, routes):
+    root, mp, accts, cards = nodes
+    lookup = LocalParents({
+        ('c1', 'mp'): 'm1', ('c2', 'mp'): 'm1', ('m1', 'root'): 'r',
+    })
+    resolver = ParentResolver(lookup)
+    path = [routes, mp, cards]
+    assert resolver.resolve(['c1', 'c2', 'c3'], path) == [
+        ['c1', 'm1', 'r'], ['c2', 'm1', 'r'], ['c3', None]
+    ]
+    # one lookup per hop, for every entity
+    assert lookup.calls == [(['c1', 'c2', 'c3'], 'mp'), (['m1'], 'root')]
+    # resolved parents are cached
+    assert resolver.resolve_async(['c1'], path).get() == [['c1', 'm1', 'r']]
+    assert len(lookup.calls) == 2
+
+    failed = ParentResolver(lambda entities, node: 1 / 0).resolve_async(
+        ['c1'], path
+    )
+    assert not failed.successful()
+    with pytest.raises(ZeroDivisionError):
+        failed.get()
+
+
+def test_parent_resolver_concurrent(nodes, routes):
+    root, mp, accts, cards = nodes
+    lookup = LocalParents(dict(
+        [(('c%d' % i, 'mp'), 'm%d' % i) for i in range(4)] +
+        [(('m%d' % i, 'root'), 'r') for i in range(4)]
+    ), latency=0.1)
+    pool = ThreadPool(4)
+    try:
+        resolver = ParentResolver(lookup, pool=pool)
+        started = time.time()
+        lineages = resolver.resolve_many(
+            [(['c%d' % i], [routes, mp, cards]) for i in range(4)]
+        )
+        elapsed = time.time() - started
+    finally:
+        pool.close()
+    assert lineages == [[['c%d' % i, 'm%d' % i, 'r']] for i in range(4)]
+    assert len(lookup.calls) == 8
+    # the four routes' two hops overlap, rather than taking 0.8s in turn
+    assert elapsed < 0.6
+
+
+@pytest.mark.parametrize('threads', ['0', '2'])
+def test_route_async(threads):
+    app = TestApp(simple_app.make_app(**{'maze.route_threads': threads}))
+    lookup_threads = set()
+    query_threads = set()
+    statements = []
+
+    def lookup(resources, node):
+        lookup_threads.add(threading.current_thread())
+        if node.name == 'Root':
+            return [resource.request.root for resource in resources]
+        return [
+            simple_app.Corporations(
+                request=resource.request,
+                parent=simple_app.Corporations,
+                name=resource.__name__,
+                entity=simple_app.CorporationsModel(
+                    pk='CR%s' % resource.__name__[2:]
+                )
+            )
+            for resource in resources
+        ]
+
+    def track_queries(conn, cursor, statement, *args):
+        query_threads.add(threading.current_thread())
+        statements.append(statement)
+
+    def show(self):
+        # looked up by the resources themselves, through the session
+        default = self.route_async(include=[simple_app.Corporations]).get()
+        results = [
+            self.route_async(include=[simple_app.Corporations], lookup=lookup),
+            self.route_async(),
+            self.route_many_async(
+                [simple_app.DepartmentsModel(pk='DP1')],
+                include=[simple_app.Corporations], lookup=lookup
+            ),
+        ]
+        return simple_app.render_to_response(
+            'json', [default] + [result.get() for result in results],
+            request=self.request
+        )
+
+    simple_app.ses.expunge_all()
+    event.listen(simple_app.engine, 'before_cursor_execute', track_queries)
+    try:
+        with mock.patch.object(simple_app.DepartmentsController, 'show',
+                               show):
+            # the corporation isn't traversed, so it must be looked up
+            res = app.get('/Departments/DP456')
+    finally:
+        event.remove(simple_app.engine, 'before_cursor_execute',
+                     track_queries)
+        if threads != '0':
+            app.app.registry.maze_pool.close()
+    # only the given lookups run on the pool, while the default ones stay
+    # on the request's thread, with its session
+    main_thread = threading.current_thread()
+    assert query_threads == set([main_thread])
+    assert any('FROM corporations' in statement for statement in statements)
+    if threads != '0':
+        assert main_thread not in lookup_threads
+    assert res.json == [
+        '/Corporations/CR123/Departments/DP456',
+        '/Corporations/CR123/Departments/DP456',
+        '/Departments/DP456',
+        ['/Corporations/CR1/Departments/DP1'],
+    ]
+
+
+def test_route_pool_fork():
+    registry = simple_app.make_app(**{'maze.route_threads': '2'}).registry
+    pool = simple_app.route_pool(registry)
+    assert simple_app.route_pool(registry) is pool
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if not pid:
+        try:
+            # the parent's pool has no threads in here
+            result = simple_app.route_pool(registry).apply_async(
+                lambda: b'forked'
+            )
+            os.write(write, result.get(2))
+        finally:
+            os._exit(0)
+    os.close(write)
+    os.waitpid(pid, 0)
+    try:
+        assert os.read(read, 1024) == b'forked'
+    finally:
+        os.close(read)
+        pool.close()
+    assert simple_app.route_pool(registry) is pool
+
+
+def test_dispatcher(nodes, routes):
+    root, mp, accts, cards = nodes
+    g = Graph(routes)
+    dispatcher = Dispatcher(g)
+    assert dispatcher.match(('mp', '1', 'cards', '2')) == (
+        [(mp, '1'), (cards, '2')], ()
+    )
+    assert dispatcher.match(('mp', '1', 'accts')) == (
+        [(mp, '1'), (accts, None)], ()
+    )
+    assert dispatcher.match(()) == ([], ())
+    # matching stops where the path stops following the graph
+    assert dispatcher.match(('cards', '1', 'mp', '2')) == (
+        [(cards, '1')], ('mp', '2')
+    )
+    assert dispatcher.match(('loans', '1')) == ([], ('loans', '1'))
+
+    # resources registered later are dispatched to
+    loans = Node('loans')
+    cards.add_child(loans)
+    assert dispatcher.match(('cards', '1', 'loans', '2')) == (
+        [(cards, '1'), (loans, '2')], ()
+    )
+
+
+@pytest.mark.parametrize('path,status', [
+    ('/Corporations/CR123/Departments/DP456', 200),
+    ('/Departments/DP456', 200),
+    ('/Corporations/CR123/Departments/DP000', 404),
+    ('/Corporations/CR123/Employees', 404),
+    ('/Corporations/CR123/CR123', 404),
+    # no views are named, so trailing view names aren't found either way
+    ('/Corporations/CR123/edit', 404),
+    ('/Corporations/CR123/Departments/DP456/export/csv', 404),
+])
+def test_app_dispatch(path, status):
+    expected = TestApp(simple_app.make_app()).get(path, status=status)
+    app = TestApp(simple_app.make_app(**{'maze.dispatch': 'true'}))
+    res = app.get(path, status=status)
+    if status == 200:
+        assert res.json == expected.json
+
+
+@pytest.mark.parametrize('path', [
+    '/',
+    '/edit',
+    '/Corporations',
+    '/Corporations/CR123/edit',
+    '/Corporations/CR123/Departments/DP456/export/csv',
+    '/Corporations/CR123/Departments/DP000/export',
+])
+def test_dispatch_traverser(app, path):
+    registry = app.app.registry
+
+    def traverse(traverser):
+        request = Request.blank(path)
+        request.registry = registry
+        result = traverser(simple_app.Root(request))(request)
+        context = result.pop('context')
+        for key in ('root', 'virtual_root'):
+            assert isinstance(result.pop(key), simple_app.Root)
+        result['context'] = (
+            type(context), context.__name__, context.entity
+        )
+        return result
+
+    # trailing view names and subpaths are traversed as usual
+    assert traverse(simple_app.MazeTraverser) == traverse(
+        ResourceTreeTraverser
+    )
+
+
+def test_app_dispatch_rejects_early(statements):
+    app = TestApp(simple_app.make_app(**{'maze.dispatch': 'true'}))
+    # employees have no model, so traversal would fail looking one up
+    app.get('/Employees/EM1/Corporations/CR123', status=404)
+    app.get('/Corporations/CR123/Employees/EM1/Departments', status=404)
+    assert statements == []
+    simple_app.ses.expunge_all()
+    app.get('/Corporations/CR123/Departments/DP456')
+    assert statements
+
+    # along with prefetching, a nested url costs a single query
+    app = TestApp(simple_app.make_app(**{
+        'maze.dispatch': 'true', 'maze.prefetch': 'true',
+    }))
+    simple_app.ses.expunge_all()
+    del statements[:]
+    app.get('/Corporations/CR123/Departments/DP456')
+    assert len(statements) == 1
+
+
+def test_relation_keys():
+    assert simple_app.DepartmentsModel.relation_keys() == {
+        'corporations': 'corporation',
+        'employees': 'employees',
+    }
+    assert simple_app.EmployeesModel.relation_keys() == {
+        'departments': 'department',
+    }
+
+
 def test_maze_graph_construction(app):
     assert len(app.app.registry.graph.nodes) == 4
+    assert len(app.app.registry.routes) >= 4
     app.app.registry.graph.draw()